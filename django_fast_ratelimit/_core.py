@@ -14,9 +14,16 @@ from typing import Any, Awaitable, Final, Optional, Union
 
 from django.conf import settings
 from django.core.cache import caches
+from django.core.signals import setting_changed
 from django.http import HttpRequest
 
-from ._epoch import areset_epoch, epoch_call_count, reset_epoch
+from ._epoch import (
+    apop_count,
+    areset_epoch,
+    epoch_call_count,
+    pop_count,
+    reset_epoch,
+)
 from .misc import ALL, Action, Disabled, MissingRate, Ratelimit, invertedset
 
 key_type: Final = Union[str, tuple, list, bytes, int, bool]
@@ -38,7 +45,7 @@ _PERIOD_MAP: Final = {
 }
 
 
-# clear if you test multiple RATELIMIT_GROUP_HASH definitions
+# cleared by _setting_changed if RATELIMIT_GROUP_HASH changes
 @functools.lru_cache()
 def _get_group_hash(group: str) -> str:
     return base64.b85encode(
@@ -50,11 +57,9 @@ def _get_group_hash(group: str) -> str:
 
 
 def _get_cache_key(group: str, hashctx, prefix: str):
-    return "%(prefix)s%(group)s:%(parts)s" % {
-        "prefix": prefix,
-        "group": _get_group_hash(group),
-        "parts": base64.b85encode(hashctx.digest()).decode("ascii"),
-    }
+    # the group is encoded and hashed only once, see _get_group_hash
+    parts = base64.b85encode(hashctx.digest()).decode("ascii")
+    return f"{prefix}{_get_group_hash(group)}:{parts}"
 
 
 @functools.lru_cache()
@@ -72,6 +77,16 @@ def _parse_parts(rate: tuple, methods: frozenset, hashname: str):
     return hasher
 
 
+def _setting_changed(*, setting, **kwargs):
+    if setting == "RATELIMIT_GROUP_HASH":
+        _get_group_hash.cache_clear()
+    elif setting == "RATELIMIT_KEY_HASH":
+        _parse_parts.cache_clear()
+
+
+setting_changed.connect(_setting_changed)
+
+
 def _check_rate(fn):
     @functools.wraps(fn)
     def _wrapper(*args):
@@ -92,7 +107,7 @@ def parse_rate(rate) -> tuple[int, int]:
 @parse_rate.register(str)
 @functools.lru_cache()
 @_check_rate
-def _(rate) -> tuple[int, int]:
+def _parse_rate_str(rate) -> tuple[int, int]:
     try:
         counter, multiplier, period = _rate.match(rate).groups()
     except AttributeError as e:
@@ -153,15 +168,27 @@ def _(key):
     if len(key) > 1:
         return fun(*key[1:])
     if hasattr(fun, "dispatch"):
+        # resolved once, requests call the implementation without dispatching
         fun = fun.dispatch(HttpRequest)
     return fun
 
 
 @_retrieve_key_func.register(str)
-def _(key):
+@functools.lru_cache(maxsize=256)
+def _retrieve_key_func_str(key):
+    # key functions are built once per key string
     return _retrieve_key_func(key.split(":", 1))
 
 
+def _resolve_key(key):
+    # skip the singledispatch lookup for the common key string case
+    if isinstance(key, str):
+        return _retrieve_key_func_str(key)
+    if isinstance(key, (tuple, list)):
+        return _retrieve_key_func(key)
+    return key
+
+
 @functools.lru_cache(maxsize=1, typed=True)
 def _get_RATELIMIT_ENABLED(settings):
     enabled = getattr(settings, "RATELIMIT_ENABLED", None)
@@ -242,16 +269,16 @@ def get_ratelimit(
         methods = {methods}
     if not isinstance(methods, frozenset):
         methods = frozenset(methods)
-    # shortcut allow
-    if request and request.method not in methods:
+    # shortcut allow, ALL is checked by identity (invertedset.__contains__ is slow)
+    if request and methods is not ALL and request.method not in methods:
         return Ratelimit(group=group, end=0)
 
-    if isinstance(key, (str, tuple, list)):
-        key = _retrieve_key_func(key)
+    key = _resolve_key(key)
 
     if callable(rate):
         rate = rate(request, group, action)
-    rate = parse_rate(rate)
+    # strings are the common case, skip the dispatch
+    rate = _parse_rate_str(rate) if type(rate) is str else parse_rate(rate)
 
     if callable(key):
         key = key(request, group, action, None if rate is _missing_rate_tuple else rate)
@@ -313,41 +340,50 @@ def get_ratelimit(
     # use a fixed window counter algorithm
     if action == Action.INCREASE:
         epoch_call_count(epoch, cache_key)
-        # start with 1 (as if increased)
-        if cache.add(cache_key, 1, rate[1]):
-            cache.set("%s_expire" % cache_key, cur_time + rate[1], rate[1])
-            count = 1
-        else:
+        count = None
+        if not is_expired:
+            # window is running, so the counter should exist, count up directly
             try:
                 # incr does not extend cache duration
                 count = cache.incr(cache_key)
             except ValueError:
-                # not in cache, but should be in cache, race condition
-                if _fail_count >= 3:
-                    raise ValueError("buggy cache or racing cache clear")
-                return get_ratelimit(
-                    request=request,
-                    epoch=epoch,
-                    hashctx=hashctx,
-                    key=True,
-                    rate=rate,
-                    action=action,
-                    group=group,
-                    prefix=prefix,
-                    cache=cache,
-                    _fail_count=_fail_count + 1,
-                )
+                # counter vanished, start a new one
+                pass
+        if count is None:
+            # start with 1 (as if increased)
+            if cache.add(cache_key, 1, rate[1]):
+                cache.set("%s_expire" % cache_key, cur_time + rate[1], rate[1])
+                count = 1
+            else:
+                try:
+                    # incr does not extend cache duration
+                    count = cache.incr(cache_key)
+                except ValueError:
+                    # not in cache, but should be in cache, race condition
+                    if _fail_count >= 3:
+                        raise ValueError("buggy cache or racing cache clear")
+                    return get_ratelimit(
+                        request=request,
+                        epoch=epoch,
+                        hashctx=hashctx,
+                        key=True,
+                        rate=rate,
+                        action=action,
+                        group=group,
+                        prefix=prefix,
+                        cache=cache,
+                        _fail_count=_fail_count + 1,
+                    )
     elif is_expired:
         # shortcut, we know the cache is now empty
         count = 0
     elif action == Action.RESET_EPOCH and epoch:
         count = cache.get(cache_key, 0)
         reset_epoch(epoch, cache, cache_key)
-
+    elif action == Action.RESET:
+        count = pop_count(cache, cache_key)
     else:
         count = cache.get(cache_key, 0)
-        if action == Action.RESET:
-            cache.delete_many([cache_key, "%s_expire" % cache_key])
 
     return Ratelimit(
         count=count,
@@ -447,19 +483,19 @@ async def aget_ratelimit(
         methods = {methods}
     if not isinstance(methods, frozenset):
         methods = frozenset(methods)
-    # shortcut allow
-    if request and request.method not in methods:
+    # shortcut allow, ALL is checked by identity (invertedset.__contains__ is slow)
+    if request and methods is not ALL and request.method not in methods:
         return Ratelimit(group=group, end=0)
 
-    if isinstance(key, (str, tuple, list)):
-        key = _retrieve_key_func(key)
+    key = _resolve_key(key)
 
     if callable(rate):
         rate = rate(request, group)
 
     if isawaitable(rate):
         rate = await rate
-    rate = parse_rate(rate)
+    # strings are the common case, skip the dispatch
+    rate = _parse_rate_str(rate) if type(rate) is str else parse_rate(rate)
 
     if callable(key):
         key = key(request, group, action, None if rate is _missing_rate_tuple else rate)
@@ -523,40 +559,50 @@ async def aget_ratelimit(
     # use a fixed window counter algorithm
     if action == Action.INCREASE:
         epoch_call_count(epoch, cache_key)
-        # start with 1 (as if increased)
-        if await cache.aadd(cache_key, 1, rate[1]):
-            await cache.aset("%s_expire" % cache_key, cur_time + rate[1], rate[1])
-            count = 1
-        else:
+        count = None
+        if not is_expired:
+            # window is running, so the counter should exist, count up directly
             try:
                 # incr does not extend cache duration
                 count = await cache.aincr(cache_key)
             except ValueError:
-                # not in cache, but should be in cache, race condition
-                if _fail_count >= 3:
-                    raise ValueError("buggy cache or racing cache clear")
-                return await aget_ratelimit(
-                    request=request,
-                    epoch=epoch,
-                    hashctx=hashctx,
-                    key=True,
-                    rate=rate,
-                    action=action,
-                    group=group,
-                    prefix=prefix,
-                    cache=cache,
-                    _fail_count=_fail_count + 1,
-                )
+                # counter vanished, start a new one
+                pass
+        if count is None:
+            # start with 1 (as if increased)
+            if await cache.aadd(cache_key, 1, rate[1]):
+                await cache.aset("%s_expire" % cache_key, cur_time + rate[1], rate[1])
+                count = 1
+            else:
+                try:
+                    # incr does not extend cache duration
+                    count = await cache.aincr(cache_key)
+                except ValueError:
+                    # not in cache, but should be in cache, race condition
+                    if _fail_count >= 3:
+                        raise ValueError("buggy cache or racing cache clear")
+                    return await aget_ratelimit(
+                        request=request,
+                        epoch=epoch,
+                        hashctx=hashctx,
+                        key=True,
+                        rate=rate,
+                        action=action,
+                        group=group,
+                        prefix=prefix,
+                        cache=cache,
+                        _fail_count=_fail_count + 1,
+                    )
     elif is_expired:
         # shortcut, we know the cache is now empty
         count = 0
     elif action == Action.RESET_EPOCH and epoch:
         count = await cache.aget(cache_key, 0)
         await areset_epoch(epoch, cache, cache_key)
+    elif action == Action.RESET:
+        count = await apop_count(cache, cache_key)
     else:
         count = await cache.aget(cache_key, 0)
-        if action == Action.RESET:
-            await cache.adelete_many([cache_key, "%s_expire" % cache_key])
 
     return Ratelimit(
         count=count,
@@ -1,13 +1,35 @@
 """
-private helpers for epoch stuff
+private helpers for epoch and reset stuff
 """
 
 import time
 from typing import Optional
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.core.cache import BaseCache
 
 
+def _thread_sensitive() -> bool:
+    # threadsafe caches can be accessed in parallel from multiple threads
+    return not getattr(settings, "RATELIMIT_CACHE_THREADSAFE", False)
+
+
+def pop_count(cache: BaseCache, cache_key: str) -> int:
+    """return count and delete the counter"""
+    count = cache.get(cache_key, 0)
+    cache.delete_many([cache_key, "%s_expire" % cache_key])
+    return count
+
+
+async def apop_count(cache: BaseCache, cache_key: str) -> int:
+    if not _thread_sensitive():
+        return await sync_to_async(pop_count, thread_sensitive=False)(cache, cache_key)
+    count = await cache.aget(cache_key, 0)
+    await cache.adelete_many([cache_key, "%s_expire" % cache_key])
+    return count
+
+
 def epoch_call_count(epoch, cache_key, delta=1) -> Optional[int]:
     if epoch is None or isinstance(epoch, int):
         return epoch
@@ -46,7 +68,12 @@ async def areset_epoch(epoch, cache, cache_key) -> int:
     else:
         try:
             # decr does not extend cache duration
-            count = await cache.adecr(cache_key, call_count)
+            if _thread_sensitive():
+                count = await cache.adecr(cache_key, call_count)
+            else:
+                count = await sync_to_async(cache.decr, thread_sensitive=False)(
+                    cache_key, call_count
+                )
         except ValueError:
             # not in cache, no problem
             count = 0
@@ -10,6 +10,8 @@ __all__ = [
 ]
 
 import functools
+import socket
+import sys
 from typing import Optional
 
 from django.http import HttpRequest
@@ -19,8 +21,46 @@ from .misc import get_ip as _get_ip
 from .misc import parse_ip_to_net as _parse_ip_to_net
 from .misc import protect_sync_only as _protect_sync_only
 
+# netmasks of ipv6 prefixes, ipv4 is mapped into ::ffff:0:0/96
+_ipv6_masks = tuple(
+    ((1 << 128) - 1) ^ ((1 << (128 - prefix)) - 1) for prefix in range(129)
+)
+
+
+def _ip_to_int(ip: str):
+    # avoids ipaddress objects, which are slow to create
+    try:
+        if ":" in ip:
+            return int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), "big"), False
+        return (
+            0xFFFF00000000
+            | int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big"),
+            True,
+        )
+    except OSError:
+        # unusual notations (e.g. scope ids), ipaddress decides
+        net, is_ipv4 = _parse_ip_to_net(ip)
+        return int(net.network_address), is_ipv4
+
+
+def _exploded_net(ip_int: int, prefix: int) -> str:
+    # same format as the exploded attribute of ipaddress.IPv6Network
+    h = "%032x" % (ip_int & _ipv6_masks[prefix])
+    return "%s:%s:%s:%s:%s:%s:%s:%s/%d" % (
+        h[0:4],
+        h[4:8],
+        h[8:12],
+        h[12:16],
+        h[16:20],
+        h[20:24],
+        h[24:28],
+        h[28:32],
+        prefix,
+    )
+
 
 def _ip_to_net(args=None):
+    """returns function which maps a request to its exploded ipv6 network"""
     if not args or args is True:
         args = (128,)
 
@@ -31,10 +71,11 @@ def _ip_to_net(args=None):
     if len(args) == 1:
         assert args[0] >= 0
         assert args[0] <= 128
+        prefix = args[0]
 
         def _(request):
-            net, is_ipv4 = _parse_ip_to_net(_get_ip(request))
-            return net.supernet(new_prefix=args[0])
+            ip_int = _ip_to_int(_get_ip(request))[0]
+            return _exploded_net(ip_int, prefix)
 
         return _
 
@@ -43,14 +84,12 @@ def _ip_to_net(args=None):
         assert args[0] <= 32
         assert args[1] >= 0
         assert args[1] <= 128
+        prefix_ipv4 = 96 + args[0]
+        prefix_ipv6 = args[1]
 
         def _(request):
-            net, is_ipv4 = _parse_ip_to_net(_get_ip(request))
-            if is_ipv4:
-                return net.supernet(new_prefix=96 + args[0])
-
-            else:
-                return net.supernet(new_prefix=args[1])
+            ip_int, is_ipv4 = _ip_to_int(_get_ip(request))
+            return _exploded_net(ip_int, prefix_ipv4 if is_ipv4 else prefix_ipv6)
 
         return _
 
@@ -59,32 +98,33 @@ _ip_to_net_single = _ip_to_net()
 
 
 def _get_user_pk_as_str_or_none(request) -> Optional[str]:
-    if not hasattr(request, "user"):
+    # request.user is usually a lazy proxy, resolve it only once
+    user = getattr(request, "user", None)
+    if user is None:
         return None
-    if (
-        request.user.is_active
-        and request.user.is_authenticated
-        and getattr(request.user, "pk", None)
-    ):
-        return "user:%s" % request.user.pk
+    if user.is_active and user.is_authenticated:
+        pk = getattr(user, "pk", None)
+        if pk:
+            return "user:%s" % pk
     return None
 
 
 def _get_user_privileged(
     request, user_ok=False, staff_ok=False, permissions=()
 ) -> Optional[str]:
-    if not hasattr(request, "user"):
+    user = getattr(request, "user", None)
+    if user is None:
         return False
-    if request.user.is_active and request.user.is_authenticated:
+    if user.is_active and user.is_authenticated:
         if user_ok:
             return True
         if permissions:
             # includes superuser check
-            if request.user.has_perms(permissions):
+            if user.has_perms(permissions):
                 return True
-        elif getattr(request.user, "is_superuser", False):
+        elif getattr(user, "is_superuser", False):
             return True
-        if staff_ok and getattr(request.user, "is_staff", False):
+        if staff_ok and getattr(user, "is_staff", False):
             return True
     return False
 
@@ -103,25 +143,22 @@ def _(request: HttpRequest, group, action, rate, key=b"static"):
     return key
 
 
-@functools.singledispatch
-@_protect_sync_only
-def user_or_ip(request: HttpRequest, group, action, rate, ip_fn=_ip_to_net_single):
+def _user_or_ip(request: HttpRequest, group, action, rate, ip_fn=_ip_to_net_single):
     user = _get_user_pk_as_str_or_none(request)
     if user:
         return user
-    net = ip_fn(request)
-    return net.exploded
+    return ip_fn(request)
+
+
+_user_or_ip_default = _protect_sync_only(_user_or_ip)
+user_or_ip = functools.singledispatch(_user_or_ip_default)
 
 
 @user_or_ip.register(str)
 @user_or_ip.register(list)
 @user_or_ip.register(tuple)
 def _(netmask):
-    ip_fn = _ip_to_net(netmask)
-
-    return _protect_sync_only(
-        functools.partial(user_or_ip.dispatch(HttpRequest).__wrapped__, ip_fn=ip_fn)
-    )
+    return _protect_sync_only(functools.partial(_user_or_ip, ip_fn=_ip_to_net(netmask)))
 
 
 @functools.singledispatch
@@ -153,7 +190,7 @@ def user_or_ip_exempt(
     if not net:
         # block
         return 1
-    return net.exploded
+    return net
 
 
 @user_or_ip_exempt.register(str)
@@ -235,12 +272,12 @@ def _(args):
 
 
 @functools.singledispatch
-def get(_noarg, group, action, rate):
+def get(_noarg, *args):
     raise ValueError("invalid argument")
 
 
 @get.register(dict)
-def _(config):
+def _get_from_dict(config):
     headers = set(config.get("HEADER", []))
     netmask = config.get("IP")
     # ipv4, ipv6, default ipv6 (ipv4 is too fragmented)
@@ -252,18 +289,21 @@ def _(config):
     if netmask:
         ip_fn = _ip_to_net(netmask)
 
-    headers = list(sorted(headers))
-    session_keys = list(sorted(set(config.get("SESSION", []))))
-    post_set = set(config.get("POST", []))
-    get_set = set(config.get("GET", []))
-    sorted_args = list(sorted(post_set | get_set))
+    # tuples iterate faster, interned names allow identity comparisons
+    headers = tuple(map(sys.intern, sorted(headers)))
+    session_keys = tuple(
+        arg if arg is None else sys.intern(arg)
+        for arg in sorted(set(config.get("SESSION", [])))
+    )
+    post_set = frozenset(map(sys.intern, config.get("POST", [])))
+    get_set = frozenset(map(sys.intern, config.get("GET", [])))
+    sorted_args = tuple(sorted(post_set | get_set))
     check_user = config.get("USER", False)
     assert isinstance(check_user, bool), "USER can only be boolean"
 
     def _generate_key(request):
         if ip_fn:
-            ip = ip_fn(request)
-            yield ip.exploded
+            yield ip_fn(request)
         if check_user:
             user = _get_user_pk_as_str_or_none(request)
             if user:
@@ -294,13 +334,13 @@ def _(config):
 
 
 @get.register(str)
-def _(*args):
+def _get_from_strs(*args):
     if len(args) == 1:
         args = args[0].split(",")
     g = {
         "IP": False,
         "USER": False,
-        "SESSION": False,
+        "SESSION": [],
         "HEADER": [],
         "GET": [],
         "POST": [],
@@ -317,12 +357,20 @@ def _(*args):
             g[uppername].append(value)
         elif value:
             g[uppername].append(value)
-    return get(g)
+    if not (g["SESSION"] or g["HEADER"] or g["GET"] or g["POST"]):
+        # common case: only flags, reuse the prebuilt key functions
+        fn = _get_flag_defaults.get((g["IP"], g["USER"]))
+        if fn:
+            return fn
+    return _get_from_dict(g)
+
+
+_user_and_ip_default = get({"IP": True, "USER": True})
 
 
 @functools.singledispatch
 def user_and_ip(request: HttpRequest, group, action, rate):
-    return get({"IP": True, "USER": True})(request, group, action, rate)
+    return _user_and_ip_default(request, group, action, rate)
 
 
 @user_and_ip.register(str)
@@ -333,7 +381,8 @@ def _(netmask):
 user = get({"USER": True})
 
 
-ip = functools.singledispatch(get({"IP": True}))
+_ip_default = get({"IP": True})
+ip = functools.singledispatch(_ip_default)
 
 
 @ip.register(str)
@@ -341,3 +390,11 @@ ip = functools.singledispatch(get({"IP": True}))
 @ip.register(tuple)
 def _(netmask):
     return get({"IP": netmask})
+
+
+# (IP, USER) flags to prebuilt key functions, used by get with strings
+_get_flag_defaults = {
+    (True, False): _ip_default,
+    (False, True): user,
+    (True, True): _user_and_ip_default,
+}
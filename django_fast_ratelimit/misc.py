@@ -28,9 +28,10 @@ from typing import Final, Literal, Optional, Union
 from django.conf import settings
 from django.core.cache import BaseCache
 from django.core.exceptions import PermissionDenied
+from django.core.signals import setting_changed
 from django.http import HttpRequest
 
-from ._epoch import areset_epoch, reset_epoch
+from ._epoch import apop_count, areset_epoch, pop_count, reset_epoch
 
 
 class Action(IntEnum):
@@ -40,6 +41,37 @@ class Action(IntEnum):
     RESET_EPOCH = 4
 
 
+# waiters of the same loop, group and end share one timer
+# key: (loop, group, end), value: [future, timer handle, number of waiters]
+_end_waiters: dict = {}
+
+
+def _release_end_waiters(fut):
+    if not fut.done():
+        fut.set_result(None)
+
+
+async def _wait_for_end(group, end, remaining_dur):
+    loop = asyncio.get_running_loop()
+    key = (loop, group, end)
+    entry = _end_waiters.get(key)
+    if entry is None:
+        fut = loop.create_future()
+        handle = loop.call_later(remaining_dur, _release_end_waiters, fut)
+        entry = _end_waiters[key] = [fut, handle, 0]
+    entry[2] += 1
+    try:
+        # a cancelled waiter must not cancel the others
+        await asyncio.shield(entry[0])
+    finally:
+        # also runs when the loop cancels its tasks on shutdown
+        entry[2] -= 1
+        if not entry[2]:
+            entry[1].cancel()
+            if _end_waiters.get(key) is entry:
+                del _end_waiters[key]
+
+
 _deco_options = {}
 if sys.version_info >= (3, 10):
     _deco_options["slots"] = True
@@ -62,32 +94,34 @@ class Ratelimit:
     def check(self, block=False):
         if self.request_limit > 0:
             if block:
-                raise RatelimitExceeded(ratelimit=self)
+                raise RatelimitExceeded(self)
             return False
         return True
 
     async def acheck(self, wait=False, block=False):
         if self.request_limit > 0:
             if wait:
+                # end is a public wall clock timestamp, so only the remaining
+                # duration is derived from it; waiters of the same window share
+                # one timer on the monotonic loop clock
                 remaining_dur = self.end - int(time.time())
                 if remaining_dur > 0:
-                    await asyncio.sleep(remaining_dur)
+                    await _wait_for_end(self.group, self.end, remaining_dur)
             if block:
-                raise RatelimitExceeded(ratelimit=self)
+                raise RatelimitExceeded(self)
             return False
         return True
 
     @property
     def can_reset(self):
-        return self.cache and self.cache_key
+        # cache and cache_key are public, so not precomputed
+        return self.cache is not None and bool(self.cache_key)
 
     def reset(self, epoch=None) -> Optional[int]:
         if not self.can_reset:
             return None
         if not epoch:
-            count = self.cache.get(self.cache_key, 0)
-            self.cache.delete_many([self.cache_key, "%s_expire" % self.cache_key])
-            return count
+            return pop_count(self.cache, self.cache_key)
         else:
             return reset_epoch(epoch, self.cache, self.cache_key)
 
@@ -95,11 +129,7 @@ class Ratelimit:
         if not self.can_reset:
             return None
         if not epoch:
-            count = await self.cache.aget(self.cache_key, 0)
-            await self.cache.adelete_many(
-                [self.cache_key, "%s_expire" % self.cache_key]
-            )
-            return count
+            return await apop_count(self.cache, self.cache_key)
         else:
             return await areset_epoch(epoch, self.cache, self.cache_key)
 
@@ -107,26 +137,30 @@ class Ratelimit:
         if replace:
             setattr(obj, name, self)
             return self
+        # at most one read and one write of the attribute
+        oldrlimit = getattr(obj, name, None)
+        if not isinstance(oldrlimit, Ratelimit):
+            result = self
+        elif oldrlimit is self or oldrlimit == self:
+            return oldrlimit
+        elif bool(oldrlimit.request_limit) != bool(self.request_limit):
+            if not self.request_limit:
+                return oldrlimit
+            result = self
+        elif oldrlimit.end > self.end:
+            self.request_limit += oldrlimit.request_limit
+            result = self
         else:
-            oldrlimit = getattr(obj, name, None)
-            if oldrlimit != self:
-                if not oldrlimit:
-                    setattr(obj, name, self)
-                elif bool(oldrlimit.request_limit) != bool(self.request_limit):
-                    if self.request_limit:
-                        setattr(obj, name, self)
-                elif oldrlimit.end > self.end:
-                    self.request_limit += oldrlimit.request_limit
-                    setattr(obj, name, self)
-                else:
-                    # oldrlimit.end <= self.end
-                    oldrlimit.request_limit += self.request_limit
-            return getattr(obj, name)
+            # oldrlimit.end <= self.end
+            oldrlimit.request_limit += self.request_limit
+            return oldrlimit
+        setattr(obj, name, result)
+        return result
 
     def decorate_object(
         self, obj=None, *, name="ratelimit", block=False, replace=False
     ):
-        if not obj:
+        if obj is None:
             return functools.partial(
                 self.decorate_object, name=name, block=block, replace=replace
             )
@@ -140,7 +174,7 @@ class Ratelimit:
     async def adecorate_object(
         self, obj=None, *, name="ratelimit", wait=False, block=False, replace=False
     ):
-        if not obj:
+        if obj is None:
             return functools.partial(
                 self.adecorate_object,
                 name=name,
@@ -156,13 +190,16 @@ class Ratelimit:
         return obj
 
 
+_frozenset_contains = frozenset.__contains__
+
+
 class invertedset(frozenset):
     """
     Inverts a collection
     """
 
     def __contains__(self, item):
-        return not super().__contains__(item)
+        return not _frozenset_contains(self, item)
 
 
 ALL: Final = invertedset()
@@ -173,7 +210,12 @@ UNSAFE: Final = invertedset(SAFE)
 class RatelimitExceeded(PermissionDenied):
     ratelimit = None
 
-    def __init__(self, *args, ratelimit: Ratelimit):
+    def __init__(self, *args, ratelimit: Optional[Ratelimit] = None):
+        # ratelimit can be passed as first positional argument
+        if ratelimit is None and args and isinstance(args[0], Ratelimit):
+            ratelimit, args = args[0], args[1:]
+        if ratelimit is None:
+            raise TypeError("ratelimit argument missing")
         self.ratelimit = ratelimit
         super().__init__(*args)
 
@@ -181,7 +223,12 @@ class RatelimitExceeded(PermissionDenied):
 class Disabled(PermissionDenied):
     ratelimit = None
 
-    def __init__(self, *args, ratelimit: Ratelimit):
+    def __init__(self, *args, ratelimit: Optional[Ratelimit] = None):
+        # ratelimit can be passed as first positional argument
+        if ratelimit is None and args and isinstance(args[0], Ratelimit):
+            ratelimit, args = args[0], args[1:]
+        if ratelimit is None:
+            raise TypeError("ratelimit argument missing")
         self.ratelimit = ratelimit
         super().__init__(*args)
 
@@ -197,55 +244,98 @@ def protect_sync_only(fn):
         try:
             loop = asyncio.get_running_loop()
         except RuntimeError:
-            loop = None
-        if loop:
-            return loop.run_in_executor(None, fn, *args)
-        return fn(*args)
+            return fn(*args)
+        return loop.run_in_executor(None, fn, *args)
 
     return inner
 
 
-@functools.lru_cache(maxsize=1)
+# lazy initialized, get_ip reads it directly and skips the call
+_trusted_proxies: Optional[Union[frozenset, invertedset]] = None
+
+
 def get_RATELIMIT_TRUSTED_PROXY() -> Union[frozenset, invertedset]:
-    s = getattr(settings, "RATELIMIT_TRUSTED_PROXIES", ["unix"])
-    if s == "all":
-        return ALL
-    else:
-        return frozenset(s)
+    global _trusted_proxies
+    trusted_proxies = _trusted_proxies
+    if trusted_proxies is None:
+        # no lock needed: concurrent threads compute the same value
+        s = getattr(settings, "RATELIMIT_TRUSTED_PROXIES", ["unix"])
+        if s == "all":
+            trusted_proxies = ALL
+        else:
+            trusted_proxies = frozenset(s)
+        _trusted_proxies = trusted_proxies
+    return trusted_proxies
+
+
+def _clear_RATELIMIT_TRUSTED_PROXY():
+    global _trusted_proxies
+    _trusted_proxies = None
+
+
+# keep lru_cache compatible interface
+get_RATELIMIT_TRUSTED_PROXY.cache_clear = _clear_RATELIMIT_TRUSTED_PROXY
+
 
+def _setting_changed(*, setting, **kwargs):
+    if setting == "RATELIMIT_TRUSTED_PROXIES":
+        _clear_RATELIMIT_TRUSTED_PROXY()
 
-_forwarded_regex = re.compile(r'for="?([^";, ]+)', re.IGNORECASE)
-_http_x_forwarded_regex = re.compile(r'[ "]*([^";, ]+)')
-_ip6_port_cleanup_regex = re.compile(r"(?<=\]):[0-9]+$")
-_ip4_port_cleanup_regex = re.compile(r":[0-9]+$")
+
+setting_changed.connect(_setting_changed)
+
+
+# header values are ascii, avoids unicode case folding
+_forwarded_regex = re.compile(r'for="?([^";, ]+)', re.IGNORECASE | re.ASCII)
+# first token, skips empty entries and quotes
+_http_x_forwarded_regex = re.compile(r'[^";, ]+', re.ASCII)
 
 
 def get_ip(request: HttpRequest):
     client_ip = request.META.get("REMOTE_ADDR", "") or "unix"
-    if client_ip in get_RATELIMIT_TRUSTED_PROXY():
-        try:
-            ip_matches = _forwarded_regex.search(request.META["HTTP_FORWARDED"])
-            client_ip = ip_matches[1]
-        except KeyError:
-            try:
-                ip_matches = _http_x_forwarded_regex.search(
-                    request.META["HTTP_X_FORWARDED_FOR"]
-                )
+    trusted_proxies = _trusted_proxies
+    if trusted_proxies is None:
+        trusted_proxies = get_RATELIMIT_TRUSTED_PROXY()
+    # ALL by identity, so plain frozensets use the fast builtin __contains__
+    if trusted_proxies is ALL or client_ip in trusted_proxies:
+        forwarded = request.META.get("HTTP_FORWARDED")
+        if forwarded:
+            ip_matches = _forwarded_regex.search(forwarded)
+            if ip_matches:
                 client_ip = ip_matches[1]
-            except KeyError:
-                pass
-    if client_ip == "testclient":  # starlite test client
-        client_ip = getattr(
-            settings,
-            "RATELIMIT_TESTCLIENT_FALLBACK",
-            "::1",
-        )
-    if client_ip in {"unix", "invalid"}:
-        raise ValueError("Could not determinate ip address")
-    if "." in client_ip and client_ip.count(":") <= 1:
-        client_ip = _ip4_port_cleanup_regex.sub("", client_ip)
+        else:
+            forwarded = request.META.get("HTTP_X_FORWARDED_FOR")
+            if forwarded:
+                ip_matches = _http_x_forwarded_regex.search(forwarded)
+                if ip_matches:
+                    client_ip = ip_matches[0]
+    elif "." in client_ip and ":" not in client_ip:
+        # common case: direct connection with plain ipv4 address
+        return client_ip
+    # special names contain no colon, ipv6 addresses skip the comparisons
+    if ":" not in client_ip:
+        if client_ip == "testclient":  # starlite test client
+            client_ip = getattr(
+                settings,
+                "RATELIMIT_TESTCLIENT_FALLBACK",
+                "::1",
+            )
+        if client_ip == "unix" or client_ip == "invalid":
+            raise ValueError("Could not determinate ip address")
+    # strip ports without regex
+    if client_ip.startswith("["):
+        # [ipv6] or [ipv6]:port
+        end = client_ip.find("]")
+        client_ip = client_ip[1:end] if end != -1 else client_ip[1:]
     else:
-        client_ip = _ip6_port_cleanup_regex.sub("", client_ip).strip("[]")
+        # ipv4:port, ipv6 addresses have more than one colon
+        colon = client_ip.find(":")
+        if (
+            colon != -1
+            and colon == client_ip.rfind(":")
+            and client_ip[colon + 1 :].isdigit()
+        ):
+            client_ip = client_ip[:colon]
 
     return client_ip
 
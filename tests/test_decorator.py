@@ -1,5 +1,6 @@
-import time
+import copy
 import unittest
+from unittest import mock
 
 from django import VERSION
 from django.http import HttpResponse
@@ -76,28 +77,33 @@ class AsyncO2gView(View):
 
 
 class DecoratorTests(TestCase):
-    def setUp(self):
-        self.factory = RequestFactory()
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.factory = RequestFactory()
+        cls.home_request = cls.factory.get("/home")
+        cls.home_post_request = cls.factory.post("/home")
+        cls.home_put_request = cls.factory.put("/home")
 
     def test_decorate_without_rate(self):
         def fn(request, group, action, rate):
             return 0
 
         func = ratelimit.decorate(key=fn)(func_beautyname)
-        r = self.factory.get("/home")
+        r = copy.copy(self.home_request)
         func(r)
 
     def test_basic(self):
         func = ratelimit.decorate(rate="1/2s", key="ip", block=True)(func_beautyname)
-        r = self.factory.get("/home")
+        r = copy.copy(self.home_request)
         func(r)
         self.assertEquals(r.ratelimit.group, "tests.test_decorator.func_beautyname")
         self.assertTrue(r.ratelimit.can_reset)
         with self.assertRaises(ratelimit.RatelimitExceeded):
-            r2 = self.factory.get("/home")
+            r2 = copy.copy(self.home_request)
             func(r2)
         r.ratelimit.reset()
-        r = self.factory.get("/home")
+        r = copy.copy(self.home_request)
         func(r)
 
     def test_methods_static(self):
@@ -109,11 +115,11 @@ class DecoratorTests(TestCase):
             block=True,
         )(func_beautyname)
         for i in range(2):
-            func(self.factory.get("/home"))
-        func(self.factory.post("/home"))
+            func(copy.copy(self.home_request))
+        func(copy.copy(self.home_post_request))
 
         with self.assertRaises(ratelimit.RatelimitExceeded):
-            func(self.factory.post("/home"))
+            func(copy.copy(self.home_post_request))
 
         func = ratelimit.decorate(
             rate="1/2s",
@@ -123,10 +129,10 @@ class DecoratorTests(TestCase):
             block=True,
         )(func_beautyname)
         for i in range(2):
-            func(self.factory.post("/home"))
-        func(self.factory.put("/home"))
+            func(copy.copy(self.home_post_request))
+        func(copy.copy(self.home_put_request))
         with self.assertRaises(ratelimit.RatelimitExceeded):
-            func(self.factory.put("/home"))
+            func(copy.copy(self.home_put_request))
 
     def test_methods_fn(self):
         def methods(request, group, action):
@@ -140,11 +146,11 @@ class DecoratorTests(TestCase):
             block=True,
         )(func_beautyname)
         for i in range(2):
-            func(self.factory.get("/home"))
-        func(self.factory.post("/home"))
+            func(copy.copy(self.home_request))
+        func(copy.copy(self.home_post_request))
 
         with self.assertRaises(ratelimit.RatelimitExceeded):
-            func(self.factory.post("/home"))
+            func(copy.copy(self.home_post_request))
 
     def test_block_without_decorate(self):
         func = ratelimit.decorate(
@@ -154,17 +160,17 @@ class DecoratorTests(TestCase):
             decorate_name=None,
             group="test_block_without_decorate",
         )(func_beautyname)
-        r = self.factory.get("/home")
+        r = copy.copy(self.home_request)
         func(r)
         self.assertFalse(hasattr(r, "ratelimit"))
         with self.assertRaises(ratelimit.RatelimitExceeded):
-            r2 = self.factory.get("/home")
+            r2 = copy.copy(self.home_request)
             func(r2)
 
     def test_disabled(self):
         func = ratelimit.decorate(rate="0/2s", key="ip")(func_beautyname)
 
-        r = self.factory.get("/home")
+        r = copy.copy(self.home_request)
         with self.assertRaises(ratelimit.Disabled):
             func(r)
         self.assertTrue(hasattr(r, "ratelimit"))
@@ -172,7 +178,7 @@ class DecoratorTests(TestCase):
         func = ratelimit.decorate(rate=(0, 1), key="ip")(func_beautyname)
 
         with self.assertRaises(ratelimit.Disabled):
-            r = self.factory.get("/home")
+            r = copy.copy(self.home_request)
             func(r)
 
     def test_force_async(self):
@@ -182,7 +188,7 @@ class DecoratorTests(TestCase):
             )(func_beautyname)
 
             with self.assertRaises(AssertionError):
-                r = self.factory.get("/home")
+                r = copy.copy(self.home_request)
                 func(r)
 
         with self.subTest("implicit force_async"):
@@ -190,7 +196,7 @@ class DecoratorTests(TestCase):
                 rate="2/2s", key="ip", group="force_async2", wait=True
             )(func_beautyname)
             with self.assertRaises(AssertionError):
-                r = self.factory.get("/home")
+                r = copy.copy(self.home_request)
                 func(r)
         with self.subTest("disabled force_async"):
             func = ratelimit.decorate(
@@ -201,16 +207,16 @@ class DecoratorTests(TestCase):
                 force_async=False,
             )(func_beautyname)
 
-            r = self.factory.get("/home")
+            r = copy.copy(self.home_request)
             func(r)
 
     def test_view(self):
-        r = self.factory.get("/home")
+        r = copy.copy(self.home_request)
         BogoView.as_view()(r)
         self.assertEquals(r.ratelimit.group, "here_required1")
 
     def test_o2goview(self):
-        r = self.factory.get("/home")
+        r = copy.copy(self.home_request)
         v = O2gView.as_view()
         v(r)
         self.assertEquals(
@@ -218,41 +224,46 @@ class DecoratorTests(TestCase):
             "%s.%s" % (O2gView.get.__module__, O2gView.get.__qualname__),
         )
         self.assertTrue(r.ratelimit2.can_reset)
-        r = self.factory.get("/home")
+        r = copy.copy(self.home_request)
         resp = v(r)
         self.assertEquals(resp.status_code, 400)
 
 
 @unittest.skipIf(VERSION[:2] < (4, 0), "unsuported")
 class AsyncDecoratorTests(TestCase):
-    def setUp(self):
-        self.factory = RequestFactory()
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.factory = RequestFactory()
+        cls.home_request = cls.factory.get("/home")
+        cls.home_post_request = cls.factory.post("/home")
+        cls.home_put_request = cls.factory.put("/home")
 
     async def test_decorate_without_rate(self):
         async def fn(request, group, action, rate):
             return 0
 
         func = ratelimit.decorate(key=fn)(afunc_beautyname)
-        r = self.factory.get("/home")
+        r = copy.copy(self.home_request)
         await func(r)
 
     async def test_basic(self):
         # sync
         func = ratelimit.decorate(rate="1/2s", key="ip", block=True)(func_beautyname2)
-        r = self.factory.get("/home")
+        r = copy.copy(self.home_request)
         await func(r)
         self.assertEquals(r.ratelimit.group, "tests.test_decorator.func_beautyname2")
         # as well as async
         func = ratelimit.decorate(rate="1/2s", key="ip", block=True)(afunc_beautyname)
-        r = self.factory.get("/home")
+        r = copy.copy(self.home_request)
         await func(r)
         self.assertEquals(r.ratelimit.group, "tests.test_decorator.afunc_beautyname")
         self.assertTrue(r.ratelimit.can_reset)
         with self.assertRaises(ratelimit.RatelimitExceeded):
-            r2 = self.factory.get("/home")
+            r2 = copy.copy(self.home_request)
             await func(r2)
         r.ratelimit.reset()
-        r = self.factory.get("/home")
+        r = copy.copy(self.home_request)
         await func(r)
 
     async def test_methods_static(self):
@@ -264,10 +275,10 @@ class AsyncDecoratorTests(TestCase):
             block=True,
         )(afunc_beautyname)
         for i in range(2):
-            await func(self.factory.get("/home"))
-        await func(self.factory.post("/home"))
+            await func(copy.copy(self.home_request))
+        await func(copy.copy(self.home_post_request))
         with self.assertRaises(ratelimit.RatelimitExceeded):
-            await func(self.factory.post("/home"))
+            await func(copy.copy(self.home_post_request))
         func = ratelimit.decorate(
             rate="1/2s",
             key="ip",
@@ -276,10 +287,10 @@ class AsyncDecoratorTests(TestCase):
             block=True,
         )(afunc_beautyname)
         for i in range(2):
-            await func(self.factory.post("/home"))
-        await func(self.factory.put("/home"))
+            await func(copy.copy(self.home_post_request))
+        await func(copy.copy(self.home_put_request))
         with self.assertRaises(ratelimit.RatelimitExceeded):
-            await func(self.factory.put("/home"))
+            await func(copy.copy(self.home_put_request))
 
     async def test_methods_fn(self):
         async def methods(request, group, action):
@@ -293,33 +304,35 @@ class AsyncDecoratorTests(TestCase):
             block=True,
         )(afunc_beautyname)
         for i in range(2):
-            await func(self.factory.get("/home"))
-        await func(self.factory.post("/home"))
+            await func(copy.copy(self.home_request))
+        await func(copy.copy(self.home_post_request))
 
         with self.assertRaises(ratelimit.RatelimitExceeded):
-            await func(self.factory.post("/home"))
+            await func(copy.copy(self.home_post_request))
 
     async def test_view(self):
-        r1 = self.factory.get("/home")
+        r1 = copy.copy(self.home_request)
         v = AsyncBogoView.as_view()
         await v(r1)
         self.assertEquals(r1.ratelimit.group, "here_required2")
 
     async def test_waitview(self):
         v = AsyncBogoWaitView.as_view()
-        await v(self.factory.get("/home"))
-        old = time.time()
-        r1 = self.factory.get("/home")
+        await v(copy.copy(self.home_request))
+        r1 = copy.copy(self.home_request)
         asyncresult = v(r1)
         self.assertFalse(hasattr(r1, "ratelimit"))
-        await asyncresult
-        new = time.time()
-        self.assertGreater(new - old, 1)
+        # don't block the test runner, check the requested wait instead
+        with mock.patch(
+            "django_fast_ratelimit.misc._wait_for_end", new_callable=mock.AsyncMock
+        ) as wait_mock:
+            await asyncresult
+        self.assertGreaterEqual(wait_mock.await_args.args[2], 1)
 
         self.assertEquals(r1.ratelimit.group, "here_required3")
 
     async def test_o2goview(self):
-        r = self.factory.get("/home")
+        r = copy.copy(self.home_request)
         v = AsyncO2gView.as_view()
         await v(r)
         self.assertEquals(
@@ -327,6 +340,6 @@ class AsyncDecoratorTests(TestCase):
             "%s.%s" % (AsyncO2gView.get.__module__, AsyncO2gView.get.__qualname__),
         )
         self.assertTrue(r.ratelimit2.can_reset)
-        r = self.factory.get("/home")
+        r = copy.copy(self.home_request)
         resp = await v(r)
         self.assertEquals(resp.status_code, 400)
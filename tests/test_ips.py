@@ -7,19 +7,24 @@ faker = Faker()
 
 
 class IpTests(TestCase):
-    def setUp(self):
-        self.factory = RequestFactory()
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.factory = RequestFactory()
+        # faker is slow, generate the addresses once
+        cls.ipv4_pool = [faker.ipv4() for i in range(4)]
+        cls.ipv6_pool = [faker.ipv6() for i in range(4)]
 
     @classmethod
     def tearDownClass(cls):
         get_RATELIMIT_TRUSTED_PROXY.cache_clear()
+        super().tearDownClass()
 
     def test_nonproxy(self):
-        rogue_address_forwarded = 'for="[{}]:42";by={},for="[{}]"'.format(
-            faker.ipv6(), faker.ipv4(), faker.ipv6()
-        )
-        rogue_address_x_forwarded_for = '"[{}]:42",'.format(faker.ipv6())
-        for addr in [faker.ipv4(), faker.ipv6()]:
+        ipv4, ipv6, ipv6_2 = self.ipv4_pool[1], self.ipv6_pool[1], self.ipv6_pool[2]
+        rogue_address_forwarded = f'for="[{ipv6}]:42";by={ipv4},for="[{ipv6_2}]"'
+        rogue_address_x_forwarded_for = f'"[{ipv6_2}]:42",'
+        for addr in [self.ipv4_pool[0], self.ipv6_pool[0]]:
             with self.subTest(addr=addr):
                 request = self.factory.get(
                     "/customer/details",
@@ -29,20 +34,45 @@ class IpTests(TestCase):
                 )
                 self.assertEqual(addr, get_ip(request))
 
+    def test_port_cleanup(self):
+        for addr, expected in [
+            ("127.0.0.1:80", "127.0.0.1"),
+            ("[::1]:80", "::1"),
+            ("[::1]", "::1"),
+            ("::1", "::1"),
+            ("::ffff:127.0.0.1", "::ffff:127.0.0.1"),
+        ]:
+            with self.subTest(addr=addr):
+                request = self.factory.get("/customer/details", REMOTE_ADDR=addr)
+                self.assertEqual(expected, get_ip(request))
+
+    def test_x_forwarded_for_tokens(self):
+        ip = self.ipv4_pool[2]
+        for header in [f"{ip};foo", f", {ip}", f' "{ip}" ,foo']:
+            with self.subTest(header=header):
+                request = self.factory.get(
+                    "/customer/details", REMOTE_ADDR="", HTTP_X_FORWARDED_FOR=header
+                )
+                self.assertEqual(ip, get_ip(request))
+
+    def test_setting_changed(self):
+        proxy = self.ipv4_pool[3]
+        get_RATELIMIT_TRUSTED_PROXY()
+        with override_settings(RATELIMIT_TRUSTED_PROXIES=[proxy]):
+            self.assertEqual(get_RATELIMIT_TRUSTED_PROXY(), frozenset([proxy]))
+        self.assertEqual(get_RATELIMIT_TRUSTED_PROXY(), frozenset(["unix"]))
+
     def _proxy_helper(self, remote_addr):
-        rogue_address_x_forwarded_for = '"[{}]:42",'.format(faker.ipv6())
-        for count, addr in enumerate([faker.ipv4(), faker.ipv6()]):
+        ipv4, ipv6, ipv6_2 = self.ipv4_pool[1], self.ipv6_pool[1], self.ipv6_pool[2]
+        rogue_address_x_forwarded_for = f'"[{ipv6_2}]:42",'
+        for count, addr in enumerate([self.ipv4_pool[0], self.ipv6_pool[0]]):
             with self.subTest("forwarded", addr=addr):
                 if count == 1:
                     addr2 = f"[{addr}]"
-                    address_forwarded = 'for="{}:42";by={},for="[{}]"'.format(
-                        addr2, faker.ipv4(), faker.ipv6()
-                    )
+                    address_forwarded = f'for="{addr2}:42";by={ipv4},for="[{ipv6}]"'
                 else:
                     addr2 = addr
-                    address_forwarded = 'for={}:42;by={},for="[{}]"'.format(
-                        addr2, faker.ipv4(), faker.ipv6()
-                    )
+                    address_forwarded = f'for={addr2}:42;by={ipv4},for="[{ipv6}]"'
                 request = self.factory.get(
                     "/customer/details",
                     REMOTE_ADDR=remote_addr,
@@ -53,14 +83,10 @@ class IpTests(TestCase):
             with self.subTest("forwarded2", addr=addr):
                 if count == 1:
                     addr2 = f"[{addr}]"
-                    address_forwarded = 'for="{}";by={},for="[{}]"'.format(
-                        addr2, faker.ipv4(), faker.ipv6()
-                    )
+                    address_forwarded = f'for="{addr2}";by={ipv4},for="[{ipv6}]"'
                 else:
                     addr2 = addr
-                    address_forwarded = 'for={};by={},for="[{}]"'.format(
-                        addr2, faker.ipv4(), faker.ipv6()
-                    )
+                    address_forwarded = f'for={addr2};by={ipv4},for="[{ipv6}]"'
                 request = self.factory.get(
                     "/customer/details",
                     REMOTE_ADDR=remote_addr,
@@ -72,12 +98,10 @@ class IpTests(TestCase):
             with self.subTest("x-forwarded-for", addr=addr):
                 if count == 1:
                     addr2 = f"[{addr}]"
-                    address_x_forwarded_for = '"{}:42","[{}]"'.format(
-                        addr2, faker.ipv6()
-                    )
+                    address_x_forwarded_for = f'"{addr2}:42","[{ipv6}]"'
                 else:
                     addr2 = addr
-                    address_x_forwarded_for = '{}:42,"[{}]"'.format(addr2, faker.ipv6())
+                    address_x_forwarded_for = f'{addr2}:42,"[{ipv6}]"'
                 request = self.factory.get(
                     "/customer/details",
                     REMOTE_ADDR=remote_addr,
@@ -87,10 +111,10 @@ class IpTests(TestCase):
             with self.subTest("x-forwarded-for2", addr=addr):
                 if count == 1:
                     addr2 = f"[{addr}]"
-                    address_x_forwarded_for = '"{}","[{}]"'.format(addr2, faker.ipv6())
+                    address_x_forwarded_for = f'"{addr2}","[{ipv6}]"'
                 else:
                     addr2 = addr
-                    address_x_forwarded_for = '{},"[{}]"'.format(addr2, faker.ipv6())
+                    address_x_forwarded_for = f'{addr2},"[{ipv6}]"'
                 request = self.factory.get(
                     "/customer/details",
                     REMOTE_ADDR=remote_addr,
@@ -102,7 +126,7 @@ class IpTests(TestCase):
         self._proxy_helper("")
 
     def test_proxy(self):
-        proxy = faker.ipv4()
+        proxy = self.ipv4_pool[3]
         get_RATELIMIT_TRUSTED_PROXY.cache_clear()
         with override_settings(RATELIMIT_TRUSTED_PROXIES=[proxy]):
             self._proxy_helper(proxy)
@@ -1,21 +1,35 @@
+import asyncio
+import copy
 import unittest
 
 from django import VERSION
 from django.contrib.auth.models import User
+from django.http import HttpRequest
 from django.test import RequestFactory, TestCase
 
 import django_fast_ratelimit as ratelimit
+from django_fast_ratelimit import methods
+from django_fast_ratelimit._core import _retrieve_key_func
 
 
 class SyncTests(TestCase):
-    def setUp(self):
-        self.factory = RequestFactory()
-        self.user_normal = User.objects.create_user(username="normal", is_staff=False)
-        self.user_staff = User.objects.create_user(username="staff", is_staff=True)
-        self.user_admin = User.objects.create_user(username="admin", is_superuser=True)
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.factory = RequestFactory()
+        cls.requests = {
+            addr: cls.factory.get("/customer/details", REMOTE_ADDR=addr)
+            for addr in ("127.0.0.1", "127.0.0.2", "127.0.1.1")
+        }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user_normal = User.objects.create_user(username="normal", is_staff=False)
+        cls.user_staff = User.objects.create_user(username="staff", is_staff=True)
+        cls.user_admin = User.objects.create_user(username="admin", is_superuser=True)
 
     def test_static(self):
-        request = self.factory.get("/customer/details")
+        request = copy.copy(self.requests["127.0.0.1"])
         r = ratelimit.get_ratelimit(
             group="test_methods_static",
             rate="1/s",
@@ -24,7 +38,7 @@ class SyncTests(TestCase):
             action=ratelimit.Action.INCREASE,
         )
         self.assertEqual(r.request_limit, 0)
-        request = self.factory.get("/customer/details")
+        request = copy.copy(self.requests["127.0.0.1"])
         r = ratelimit.get_ratelimit(
             group="test_methods_static",
             rate="1/s",
@@ -33,7 +47,7 @@ class SyncTests(TestCase):
             action=ratelimit.Action.INCREASE,
         )
         self.assertEqual(r.request_limit, 1)
-        request = self.factory.get("/customer/details")
+        request = copy.copy(self.requests["127.0.0.1"])
         r = ratelimit.get_ratelimit(
             group="test_methods_static",
             rate="1/s",
@@ -56,159 +70,68 @@ class SyncTests(TestCase):
                 action=ratelimit.Action.INCREASE,
             )
 
+    def _check_cases(self, group, cases):
+        for addr, user, key, request_limit in cases:
+            with self.subTest(addr=addr, user=user, key=key):
+                request = copy.copy(self.requests[addr])
+                if user:
+                    request.user = user
+                r = ratelimit.get_ratelimit(
+                    group=group,
+                    rate="1/s",
+                    key=key,
+                    request=request,
+                    action=ratelimit.Action.INCREASE,
+                )
+                self.assertEqual(r.request_limit, request_limit)
+
     def test_ip(self):
-        request = self.factory.get("/customer/details")
-        r = ratelimit.get_ratelimit(
-            group="test_methods_ip",
-            rate="1/s",
-            key="ip:32/128",
-            request=request,
-            action=ratelimit.Action.INCREASE,
-        )
-        self.assertEqual(r.request_limit, 0)
-        request = self.factory.get("/customer/details")
-        r = ratelimit.get_ratelimit(
-            group="test_methods_ip",
-            rate="1/s",
-            key="ip:128",
-            request=request,
-            action=ratelimit.Action.INCREASE,
-        )
-        self.assertEqual(r.request_limit, 1)
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.1.1")
-        r = ratelimit.get_ratelimit(
-            group="test_methods_ip",
-            rate="1/s",
-            key="ip:128",
-            request=request,
-            action=ratelimit.Action.INCREASE,
+        self._check_cases(
+            "test_methods_ip",
+            [
+                ("127.0.0.1", None, "ip:32/128", 0),
+                ("127.0.0.1", None, "ip:128", 1),
+                ("127.0.1.1", None, "ip:128", 0),
+            ],
         )
-        self.assertEqual(r.request_limit, 0)
 
     def test_user(self):
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
-        r = ratelimit.get_ratelimit(
-            group="test_methods_user",
-            rate="1/s",
-            key="user",
-            request=request,
-            action=ratelimit.Action.INCREASE,
+        self._check_cases(
+            "test_methods_user",
+            [
+                ("127.0.0.1", None, "user", 0),
+                ("127.0.0.2", None, "user", 1),
+                ("127.0.0.1", self.user_normal, "user", 0),
+                ("127.0.0.2", self.user_normal, "user", 1),
+            ],
         )
-        self.assertEqual(r.request_limit, 0)
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.2")
-        r = ratelimit.get_ratelimit(
-            group="test_methods_user",
-            rate="1/s",
-            key="user",
-            request=request,
-            action=ratelimit.Action.INCREASE,
-        )
-        self.assertEqual(r.request_limit, 1)
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
-        request.user = self.user_normal
-        r = ratelimit.get_ratelimit(
-            group="test_methods_user",
-            rate="1/s",
-            key="user",
-            request=request,
-            action=ratelimit.Action.INCREASE,
-        )
-        self.assertEqual(r.request_limit, 0)
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.2")
-        request.user = self.user_normal
-        r = ratelimit.get_ratelimit(
-            group="test_methods_user",
-            rate="1/s",
-            key="user",
-            request=request,
-            action=ratelimit.Action.INCREASE,
-        )
-        self.assertEqual(r.request_limit, 1)
 
     def test_user_or_ip(self):
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
-        r = ratelimit.get_ratelimit(
-            group="test_methods_user_or_ip",
-            rate="1/s",
-            key="user_or_ip",
-            request=request,
-            action=ratelimit.Action.INCREASE,
-        )
-        self.assertEqual(r.request_limit, 0)
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
-        r = ratelimit.get_ratelimit(
-            group="test_methods_user_or_ip",
-            rate="1/s",
-            key="user_or_ip:128",
-            request=request,
-            action=ratelimit.Action.INCREASE,
-        )
-        self.assertEqual(r.request_limit, 1)
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
-        request.user = self.user_normal
-        r = ratelimit.get_ratelimit(
-            group="test_methods_user_or_ip",
-            rate="1/s",
-            key="user_or_ip:32/128",
-            request=request,
-            action=ratelimit.Action.INCREASE,
-        )
-        self.assertEqual(r.request_limit, 0)
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
-        request.user = self.user_normal
-        r = ratelimit.get_ratelimit(
-            group="test_methods_user_or_ip",
-            rate="1/s",
-            key="user_or_ip",
-            request=request,
-            action=ratelimit.Action.INCREASE,
+        self._check_cases(
+            "test_methods_user_or_ip",
+            [
+                ("127.0.0.1", None, "user_or_ip", 0),
+                ("127.0.0.1", None, "user_or_ip:128", 1),
+                ("127.0.0.1", self.user_normal, "user_or_ip:32/128", 0),
+                ("127.0.0.1", self.user_normal, "user_or_ip", 1),
+            ],
         )
-        self.assertEqual(r.request_limit, 1)
 
     def test_user_and_ip(self):
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
-        r = ratelimit.get_ratelimit(
-            group="test_methods_user_and_ip",
-            rate="1/s",
-            key="user_and_ip",
-            request=request,
-            action=ratelimit.Action.INCREASE,
-        )
-        self.assertEqual(r.request_limit, 0)
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.2")
-        r = ratelimit.get_ratelimit(
-            group="test_methods_user_and_ip",
-            rate="1/s",
-            key="user_and_ip:128",
-            request=request,
-            action=ratelimit.Action.INCREASE,
+        self._check_cases(
+            "test_methods_user_and_ip",
+            [
+                ("127.0.0.1", None, "user_and_ip", 0),
+                ("127.0.0.2", None, "user_and_ip:128", 0),
+                ("127.0.0.1", self.user_normal, "user_and_ip:32/128", 0),
+                ("127.0.0.2", self.user_normal, "user_and_ip", 0),
+            ],
         )
-        self.assertEqual(r.request_limit, 0)
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
-        request.user = self.user_normal
-        r = ratelimit.get_ratelimit(
-            group="test_methods_user_and_ip",
-            rate="1/s",
-            key="user_and_ip:32/128",
-            request=request,
-            action=ratelimit.Action.INCREASE,
-        )
-        self.assertEqual(r.request_limit, 0)
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.2")
-        request.user = self.user_normal
-        r = ratelimit.get_ratelimit(
-            group="test_methods_user_and_ip",
-            rate="1/s",
-            key="user_and_ip",
-            request=request,
-            action=ratelimit.Action.INCREASE,
-        )
-        self.assertEqual(r.request_limit, 0)
 
     def test_ip_exempt_user(self):
+        request = copy.copy(self.requests["127.0.0.1"])
+        request.user = self.user_normal
         for i in range(2):
-            request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
-            request.user = self.user_normal
             r = ratelimit.get_ratelimit(
                 group="test_methods_ip_exempt_user",
                 rate="1/2s",
@@ -218,8 +141,8 @@ class SyncTests(TestCase):
             )
             self.assertEqual(r.request_limit, 0)
 
+        request = copy.copy(self.requests["127.0.0.1"])
         for i in range(2):
-            request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
             r = ratelimit.get_ratelimit(
                 group="test_methods_ip_exempt_user",
                 rate="1/2s",
@@ -230,7 +153,7 @@ class SyncTests(TestCase):
         self.assertEqual(r.request_limit, 1)
 
         # reset only when user available
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
+        request = copy.copy(self.requests["127.0.0.1"])
         r = ratelimit.get_ratelimit(
             group="test_methods_ip_exempt_user",
             rate="1/2s",
@@ -238,7 +161,7 @@ class SyncTests(TestCase):
             request=request,
             action=ratelimit.Action.RESET,
         )
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
+        request = copy.copy(self.requests["127.0.0.1"])
         r = ratelimit.get_ratelimit(
             group="test_methods_ip_exempt_user",
             rate="1/2s",
@@ -248,7 +171,7 @@ class SyncTests(TestCase):
         )
         self.assertEqual(r.request_limit, 1)
 
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
+        request = copy.copy(self.requests["127.0.0.1"])
         request.user = self.user_normal
         r = ratelimit.get_ratelimit(
             group="test_methods_ip_exempt_user",
@@ -257,7 +180,7 @@ class SyncTests(TestCase):
             request=request,
             action=ratelimit.Action.RESET,
         )
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
+        request = copy.copy(self.requests["127.0.0.1"])
         r = ratelimit.get_ratelimit(
             group="test_methods_ip_exempt_user",
             rate="1/s",
@@ -269,7 +192,7 @@ class SyncTests(TestCase):
     
     def test_ip_exempt_user_invert(self):
         for i in range(2):
-            request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
+            request = copy.copy(self.requests["127.0.0.1"])
             r = ratelimit.get_ratelimit(
                 group="test_methods_ip_exempt_user_invert",
                 rate="1/2s",
@@ -279,7 +202,7 @@ class SyncTests(TestCase):
             )
             self.assertEqual(r.request_limit, 0)
         for i in range(2):
-            request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
+            request = copy.copy(self.requests["127.0.0.1"])
             request.user = self.user_normal
             r = ratelimit.get_ratelimit(
                 group="test_methods_ip_exempt_user_invert",
@@ -291,7 +214,7 @@ class SyncTests(TestCase):
         self.assertEqual(r.request_limit, 1)
 
         # reset only when user not available
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
+        request = copy.copy(self.requests["127.0.0.1"])
         request.user = self.user_normal
         r = ratelimit.get_ratelimit(
             group="test_methods_ip_exempt_user_invert",
@@ -300,7 +223,7 @@ class SyncTests(TestCase):
             request=request,
             action=ratelimit.Action.RESET,
         )
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
+        request = copy.copy(self.requests["127.0.0.1"])
         request.user = self.user_normal
         r = ratelimit.get_ratelimit(
             group="test_methods_ip_exempt_user_invert",
@@ -311,7 +234,7 @@ class SyncTests(TestCase):
         )
         self.assertEqual(r.request_limit, 1)
 
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
+        request = copy.copy(self.requests["127.0.0.1"])
         r = ratelimit.get_ratelimit(
             group="test_methods_ip_exempt_user_invert",
             rate="1/2s",
@@ -319,7 +242,7 @@ class SyncTests(TestCase):
             request=request,
             action=ratelimit.Action.RESET,
         )
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
+        request = copy.copy(self.requests["127.0.0.1"])
         request.user = self.user_normal
         r = ratelimit.get_ratelimit(
             group="test_methods_ip_exempt_user_invert",
@@ -331,7 +254,7 @@ class SyncTests(TestCase):
         self.assertEqual(r.request_limit, 0)
 
     def test_ip_exempt_privileged(self):
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
+        request = copy.copy(self.requests["127.0.0.1"])
         request.user = self.user_normal
         r = ratelimit.get_ratelimit(
             group="test_methods_ip_exempt_privileged",
@@ -341,8 +264,6 @@ class SyncTests(TestCase):
             action=ratelimit.Action.INCREASE,
         )
         self.assertEqual(r.request_limit, 0)
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
-        request.user = self.user_normal
         r = ratelimit.get_ratelimit(
             group="test_methods_ip_exempt_privileged",
             rate="1/s",
@@ -352,19 +273,19 @@ class SyncTests(TestCase):
         )
         self.assertEqual(r.request_limit, 1)
         for user in [self.user_staff, self.user_admin]:
-            request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
-            request.user = user
-            r = ratelimit.get_ratelimit(
-                group="test_methods_ip_exempt_privileged",
-                rate="1/s",
-                key="user_or_ip_exempt:staff_ok,not_use_user_pk",
-                request=request,
-                action=ratelimit.Action.INCREASE,
-            )
-            self.assertEqual(r.request_limit, 0)
+            with self.subTest(user=user.username):
+                request.user = user
+                r = ratelimit.get_ratelimit(
+                    group="test_methods_ip_exempt_privileged",
+                    rate="1/s",
+                    key="user_or_ip_exempt:staff_ok,not_use_user_pk",
+                    request=request,
+                    action=ratelimit.Action.INCREASE,
+                )
+                self.assertEqual(r.request_limit, 0)
 
     def test_ip_exempt_superuser(self):
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
+        request = copy.copy(self.requests["127.0.0.1"])
         request.user = self.user_normal
         r = ratelimit.get_ratelimit(
             group="test_methods_ip_exempt_superuser",
@@ -374,7 +295,7 @@ class SyncTests(TestCase):
             action=ratelimit.Action.INCREASE,
         )
         self.assertEqual(r.request_limit, 0)
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
+        request = copy.copy(self.requests["127.0.0.1"])
         request.user = self.user_staff
         r = ratelimit.get_ratelimit(
             group="test_methods_ip_exempt_superuser",
@@ -384,7 +305,7 @@ class SyncTests(TestCase):
             action=ratelimit.Action.INCREASE,
         )
         self.assertEqual(r.request_limit, 1)
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
+        request = copy.copy(self.requests["127.0.0.1"])
         request.user = self.user_admin
         r = ratelimit.get_ratelimit(
             group="test_methods_ip_exempt_superuser",
@@ -400,9 +321,7 @@ class SyncTests(TestCase):
             for action in [ratelimit.Action.RESET, ratelimit.Action.RESET_EPOCH]:
                 with self.subTest("%(key)s.%(action)s", key=keyfn, action=action.name):
                     for i in range(2):
-                        request = self.factory.get(
-                            "/customer/details", REMOTE_ADDR="127.0.0.1"
-                        )
+                        request = copy.copy(self.requests["127.0.0.1"])
                         ratelimit.get_ratelimit(
                             group=f"test_methods_{keyfn}_{action.name}",
                             rate="1/s",
@@ -411,9 +330,7 @@ class SyncTests(TestCase):
                             action=ratelimit.Action.INCREASE,
                         )
 
-                    request = self.factory.get(
-                        "/customer/details", REMOTE_ADDR="127.0.0.1"
-                    )
+                    request = copy.copy(self.requests["127.0.0.1"])
                     request.user = self.user_admin
                     r = ratelimit.get_ratelimit(
                         group=f"test_methods_{keyfn}_{action.name}",
@@ -422,9 +339,7 @@ class SyncTests(TestCase):
                         request=request,
                         action=action,
                     )
-                    request = self.factory.get(
-                        "/customer/details", REMOTE_ADDR="127.0.0.1"
-                    )
+                    request = copy.copy(self.requests["127.0.0.1"])
                     r = ratelimit.get_ratelimit(
                         group=f"test_methods_{keyfn}_{action.name}",
                         rate="1/s",
@@ -439,7 +354,33 @@ class SyncTests(TestCase):
                         self.assertEqual(r.request_limit, 0)
 
     def test_get(self):
-        pass
+        request = self.factory.get(
+            "/customer/details?foo=1", REMOTE_ADDR="127.0.0.1", HTTP_X_FOO="bar"
+        )
+        self.assertEqual(
+            methods.get("ip")(request, "test_get", None, None),
+            methods.ip(request, "test_get", None, None),
+        )
+        self.assertEqual(
+            methods.get("ip", "user")(request, "test_get", None, None),
+            methods.user_and_ip(request, "test_get", None, None),
+        )
+        self.assertEqual(
+            methods.get("ip:32/64,header:HTTP_X_FOO,get:foo")(
+                request, "test_get", None, None
+            ),
+            "0000:0000:0000:0000:0000:ffff:7f00:0001/128bar1",
+        )
+        with self.assertRaises(ValueError):
+            methods.get(1)
+
+    def test_dispatch(self):
+        for fn in [methods.ip, methods.user_or_ip, methods.get]:
+            with self.subTest(fn=fn):
+                self.assertTrue(callable(fn.register))
+        # key strings resolve to the request implementation directly
+        self.assertIs(methods.ip.dispatch(HttpRequest), methods._ip_default)
+        self.assertIs(_retrieve_key_func("user_or_ip"), methods._user_or_ip_default)
 
 
 @unittest.skipIf(VERSION[:2] < (4, 0), "unsuported")
@@ -459,166 +400,93 @@ class AsyncTests(TestCase):
             cls.factoryClass = RequestFactory
         else:
             cls.factoryClass = AsyncRequestFactory
+        factory = cls.factoryClass()
+        cls.requests = {
+            addr: factory.get("/customer/details", REMOTE_ADDR=addr)
+            for addr in ("127.0.0.1", "127.0.0.2", "127.0.1.1")
+        }
 
-    def setUp(self):
-        self.factory = self.factoryClass()
-        self.user_normal = User.objects.create_user(username="normal", is_staff=False)
-        self.user_staff = User.objects.create_user(username="staff", is_staff=True)
-        self.user_admin = User.objects.create_user(username="admin", is_superuser=True)
+    @classmethod
+    def setUpTestData(cls):
+        cls.user_normal = User.objects.create_user(username="normal", is_staff=False)
+        cls.user_staff = User.objects.create_user(username="staff", is_staff=True)
+        cls.user_admin = User.objects.create_user(username="admin", is_superuser=True)
+
+    async def _check_cases(self, group, cases):
+        for addr, user, key, request_limit in cases:
+            with self.subTest(addr=addr, user=user, key=key):
+                request = copy.copy(self.requests[addr])
+                if user:
+                    request.user = user
+                r = await ratelimit.aget_ratelimit(
+                    group=group,
+                    rate="1/s",
+                    key=key,
+                    request=request,
+                    action=ratelimit.Action.INCREASE,
+                )
+                self.assertEqual(r.request_limit, request_limit)
 
     async def test_ip(self):
-        request = self.factory.get("/customer/details")
-        r = await ratelimit.aget_ratelimit(
-            group="test_methodsa_ip",
-            rate="1/s",
-            key="ip:32/128",
-            request=request,
-            action=ratelimit.Action.INCREASE,
-        )
-        self.assertEqual(r.request_limit, 0)
-        request = self.factory.get("/customer/details")
-        r = await ratelimit.aget_ratelimit(
-            group="test_methodsa_ip",
-            rate="1/s",
-            key="ip:128",
-            request=request,
-            action=ratelimit.Action.INCREASE,
-        )
-        self.assertEqual(r.request_limit, 1)
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.1.1")
-        r = await ratelimit.aget_ratelimit(
-            group="test_methodsa_ip",
-            rate="1/s",
-            key="ip:128",
-            request=request,
-            action=ratelimit.Action.INCREASE,
+        await self._check_cases(
+            "test_methodsa_ip",
+            [
+                ("127.0.0.1", None, "ip:32/128", 0),
+                ("127.0.0.1", None, "ip:128", 1),
+                ("127.0.1.1", None, "ip:128", 0),
+            ],
         )
-        self.assertEqual(r.request_limit, 0)
 
     async def test_user(self):
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
-        r = await ratelimit.aget_ratelimit(
-            group="test_methodsa_user",
-            rate="1/s",
-            key="user",
-            request=request,
-            action=ratelimit.Action.INCREASE,
+        await self._check_cases(
+            "test_methodsa_user",
+            [
+                ("127.0.0.1", None, "user", 0),
+                ("127.0.0.2", None, "user", 1),
+                ("127.0.0.1", self.user_normal, "user", 0),
+                ("127.0.0.2", self.user_normal, "user", 1),
+            ],
         )
-        self.assertEqual(r.request_limit, 0)
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.2")
-        r = await ratelimit.aget_ratelimit(
-            group="test_methodsa_user",
-            rate="1/s",
-            key="user",
-            request=request,
-            action=ratelimit.Action.INCREASE,
-        )
-        self.assertEqual(r.request_limit, 1)
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
-        request.user = self.user_normal
-        r = await ratelimit.aget_ratelimit(
-            group="test_methodsa_user",
-            rate="1/s",
-            key="user",
-            request=request,
-            action=ratelimit.Action.INCREASE,
-        )
-        self.assertEqual(r.request_limit, 0)
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.2")
-        request.user = self.user_normal
-        r = await ratelimit.aget_ratelimit(
-            group="test_methodsa_user",
-            rate="1/s",
-            key="user",
-            request=request,
-            action=ratelimit.Action.INCREASE,
-        )
-        self.assertEqual(r.request_limit, 1)
 
     async def test_user_or_ip(self):
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
-        r = await ratelimit.aget_ratelimit(
-            group="test_methodsa_user_or_ip",
-            rate="1/s",
-            key="user_or_ip",
-            request=request,
-            action=ratelimit.Action.INCREASE,
-        )
-        self.assertEqual(r.request_limit, 0)
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
-        r = await ratelimit.aget_ratelimit(
-            group="test_methodsa_user_or_ip",
-            rate="1/s",
-            key="user_or_ip:128",
-            request=request,
-            action=ratelimit.Action.INCREASE,
-        )
-        self.assertEqual(r.request_limit, 1)
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
-        request.user = self.user_normal
-        r = await ratelimit.aget_ratelimit(
-            group="test_methodsa_user_or_ip",
-            rate="1/s",
-            key="user_or_ip:32/128",
-            request=request,
-            action=ratelimit.Action.INCREASE,
-        )
-        self.assertEqual(r.request_limit, 0)
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
-        request.user = self.user_normal
-        r = await ratelimit.aget_ratelimit(
-            group="test_methodsa_user_or_ip",
-            rate="1/s",
-            key="user_or_ip",
-            request=request,
-            action=ratelimit.Action.INCREASE,
+        await self._check_cases(
+            "test_methodsa_user_or_ip",
+            [
+                ("127.0.0.1", None, "user_or_ip", 0),
+                ("127.0.0.1", None, "user_or_ip:128", 1),
+                ("127.0.0.1", self.user_normal, "user_or_ip:32/128", 0),
+                ("127.0.0.1", self.user_normal, "user_or_ip", 1),
+            ],
         )
-        self.assertEqual(r.request_limit, 1)
 
     async def test_user_and_ip(self):
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
-        r = await ratelimit.aget_ratelimit(
-            group="test_methodsa_user_and_ip",
-            rate="1/s",
-            key="user_and_ip",
-            request=request,
-            action=ratelimit.Action.INCREASE,
-        )
-        self.assertEqual(r.request_limit, 0)
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.2")
-        r = await ratelimit.aget_ratelimit(
-            group="test_methodsa_user_and_ip",
-            rate="1/s",
-            key="user_and_ip:128",
-            request=request,
-            action=ratelimit.Action.INCREASE,
-        )
-        self.assertEqual(r.request_limit, 0)
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
-        request.user = self.user_normal
-        r = await ratelimit.aget_ratelimit(
-            group="test_methodsa_user_and_ip",
-            rate="1/s",
-            key="user_and_ip:32/128",
-            request=request,
-            action=ratelimit.Action.INCREASE,
-        )
-        self.assertEqual(r.request_limit, 0)
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.2")
-        request.user = self.user_normal
-        r = await ratelimit.aget_ratelimit(
-            group="test_methodsa_user_and_ip",
-            rate="1/s",
-            key="user_and_ip",
-            request=request,
-            action=ratelimit.Action.INCREASE,
-        )
-        self.assertEqual(r.request_limit, 0)
+        # the keys are distinct, so the lookups are independent
+        calls = []
+        for key, addr, user in [
+            ("user_and_ip", "127.0.0.1", None),
+            ("user_and_ip:128", "127.0.0.2", None),
+            ("user_and_ip:32/128", "127.0.0.1", self.user_normal),
+            ("user_and_ip", "127.0.0.2", self.user_normal),
+        ]:
+            request = copy.copy(self.requests[addr])
+            if user:
+                request.user = user
+            calls.append(
+                ratelimit.aget_ratelimit(
+                    group="test_methodsa_user_and_ip",
+                    rate="1/s",
+                    key=key,
+                    request=request,
+                    action=ratelimit.Action.INCREASE,
+                )
+            )
+        for r in await asyncio.gather(*calls):
+            self.assertEqual(r.request_limit, 0)
 
     async def test_ip_exempt_user(self):
+        request = copy.copy(self.requests["127.0.0.1"])
+        request.user = self.user_normal
         for i in range(2):
-            request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
-            request.user = self.user_normal
             r = await ratelimit.aget_ratelimit(
                 group="test_methodsa_ip_exempt_user",
                 rate="1/2s",
@@ -628,8 +496,8 @@ class AsyncTests(TestCase):
             )
             self.assertEqual(r.request_limit, 0)
 
+        request = copy.copy(self.requests["127.0.0.1"])
         for i in range(2):
-            request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
             r = await ratelimit.aget_ratelimit(
                 group="test_methodsa_ip_exempt_user",
                 rate="1/2s",
@@ -640,7 +508,7 @@ class AsyncTests(TestCase):
         self.assertEqual(r.request_limit, 1)
 
         # reset only when user available
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
+        request = copy.copy(self.requests["127.0.0.1"])
         r = await ratelimit.aget_ratelimit(
             group="test_methodsa_ip_exempt_user",
             rate="1/2s",
@@ -648,7 +516,7 @@ class AsyncTests(TestCase):
             request=request,
             action=ratelimit.Action.RESET,
         )
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
+        request = copy.copy(self.requests["127.0.0.1"])
         r = await ratelimit.aget_ratelimit(
             group="test_methodsa_ip_exempt_user",
             rate="1/2s",
@@ -657,7 +525,7 @@ class AsyncTests(TestCase):
             action=ratelimit.Action.INCREASE,
         )
         self.assertEqual(r.request_limit, 1)
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
+        request = copy.copy(self.requests["127.0.0.1"])
         request.user = self.user_normal
         r = await ratelimit.aget_ratelimit(
             group="test_methodsa_ip_exempt_user",
@@ -666,7 +534,7 @@ class AsyncTests(TestCase):
             request=request,
             action=ratelimit.Action.RESET,
         )
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
+        request = copy.copy(self.requests["127.0.0.1"])
         r = await ratelimit.aget_ratelimit(
             group="test_methodsa_ip_exempt_user",
             rate="1/2s",
@@ -679,7 +547,7 @@ class AsyncTests(TestCase):
     async def test_ip_exempt_user_invert(self):
 
         for i in range(2):
-            request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
+            request = copy.copy(self.requests["127.0.0.1"])
             r = await ratelimit.aget_ratelimit(
                 group="test_methodsa_ip_exempt_user_invert",
                 rate="1/2s",
@@ -689,7 +557,7 @@ class AsyncTests(TestCase):
             )
             self.assertEqual(r.request_limit, 0)
         for i in range(2):
-            request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
+            request = copy.copy(self.requests["127.0.0.1"])
             request.user = self.user_normal
             r = await ratelimit.aget_ratelimit(
                 group="test_methodsa_ip_exempt_user_invert",
@@ -702,7 +570,7 @@ class AsyncTests(TestCase):
 
         # reset only when user is not available
 
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
+        request = copy.copy(self.requests["127.0.0.1"])
         request.user = self.user_normal
         r = await ratelimit.aget_ratelimit(
             group="test_methodsa_ip_exempt_user_invert",
@@ -711,7 +579,7 @@ class AsyncTests(TestCase):
             request=request,
             action=ratelimit.Action.RESET,
         )
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
+        request = copy.copy(self.requests["127.0.0.1"])
         request.user = self.user_normal
         r = await ratelimit.aget_ratelimit(
             group="test_methodsa_ip_exempt_user_invert",
@@ -721,7 +589,7 @@ class AsyncTests(TestCase):
             action=ratelimit.Action.INCREASE,
         )
         self.assertEqual(r.request_limit, 1)
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
+        request = copy.copy(self.requests["127.0.0.1"])
         r = await ratelimit.aget_ratelimit(
             group="test_methodsa_ip_exempt_user_invert",
             rate="1/2s",
@@ -729,7 +597,7 @@ class AsyncTests(TestCase):
             request=request,
             action=ratelimit.Action.RESET,
         )
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
+        request = copy.copy(self.requests["127.0.0.1"])
         request.user = self.user_normal
         r = await ratelimit.aget_ratelimit(
             group="test_methodsa_ip_exempt_user_invert",
@@ -741,7 +609,7 @@ class AsyncTests(TestCase):
         self.assertEqual(r.request_limit, 0)
 
     async def test_ip_exempt_privileged(self):
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
+        request = copy.copy(self.requests["127.0.0.1"])
         request.user = self.user_normal
         r = await ratelimit.aget_ratelimit(
             group="test_methodsa_ip_exempt_privileged",
@@ -751,8 +619,6 @@ class AsyncTests(TestCase):
             action=ratelimit.Action.INCREASE,
         )
         self.assertEqual(r.request_limit, 0)
-        request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
-        request.user = self.user_normal
         r = await ratelimit.aget_ratelimit(
             group="test_methodsa_ip_exempt_privileged",
             rate="1/s",
@@ -762,13 +628,13 @@ class AsyncTests(TestCase):
         )
         self.assertEqual(r.request_limit, 1)
         for user in [self.user_staff, self.user_admin]:
-            request = self.factory.get("/customer/details", REMOTE_ADDR="127.0.0.1")
-            request.user = user
-            r = await ratelimit.aget_ratelimit(
-                group="test_methodsa_ip_exempt_privileged",
-                rate="1/s",
-                key="user_or_ip_exempt:staff_ok,not_use_user_pk",
-                request=request,
-                action=ratelimit.Action.INCREASE,
-            )
-            self.assertEqual(r.request_limit, 0)
+            with self.subTest(user=user.username):
+                request.user = user
+                r = await ratelimit.aget_ratelimit(
+                    group="test_methodsa_ip_exempt_privileged",
+                    rate="1/s",
+                    key="user_or_ip_exempt:staff_ok,not_use_user_pk",
+                    request=request,
+                    action=ratelimit.Action.INCREASE,
+                )
+                self.assertEqual(r.request_limit, 0)
@@ -1,20 +1,23 @@
+import copy
+import dataclasses
 import hashlib
 import time
 import types
 import unittest
 from functools import partial, singledispatch
+from unittest import mock
 
 from django import VERSION
 from django.contrib.auth.models import AnonymousUser
 from django.core.cache.backends.base import DEFAULT_TIMEOUT
 from django.core.cache.backends.dummy import DummyCache
-from django.test import RequestFactory, TestCase, override_settings
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
 
 import django_fast_ratelimit as ratelimit
 from django_fast_ratelimit._core import (
     _get_cache_key,
-    _get_group_hash,
     _get_RATELIMIT_ENABLED,
+    _resolve_key,
     _retrieve_key_func,
     parse_rate,
 )
@@ -31,6 +34,19 @@ class AlternatingAdd(DummyCache):
         return self._random_counter == 0
 
 
+class VirtualClock:
+    """replaces time.time, sleeping just advances the clock"""
+
+    def __init__(self):
+        self.now = time.time()
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
 def _prefixed_function(request, group, action, rate):
     return b"foobar"
 
@@ -45,28 +61,52 @@ def _(arg1: str, arg2: str = ""):
     return partial(fake_key_function, arg1=arg1, arg2=arg2)
 
 
-class ConstructionTests(TestCase):
-    def setUp(self):
-        self.factory = RequestFactory()
+class ConstructionTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.factory = RequestFactory()
+        cls.home_request = cls.factory.get("/home")
 
     def test_action_compatibility(self):
         # will fail with plain Enum
         for value in ratelimit.Action.__members__.values():
             self.assertEqual(value, value.value)
 
+    def test_ratelimit_dataclass(self):
+        r = ratelimit.Ratelimit(group="foo", count=2, cache_key="bar")
+        self.assertTrue(dataclasses.is_dataclass(r))
+        r2 = dataclasses.replace(r, count=3)
+        self.assertEqual(r2.count, 3)
+        self.assertEqual(r2.cache_key, "bar")
+        # cache fields are not compared
+        self.assertEqual(r, dataclasses.replace(r, cache_key=None))
+        self.assertNotEqual(r, r2)
+
+    def test_exception_requires_ratelimit(self):
+        r = ratelimit.Ratelimit(group="foo")
+        for exc in [ratelimit.RatelimitExceeded, ratelimit.Disabled]:
+            with self.subTest(exc=exc):
+                self.assertIs(exc(r).ratelimit, r)
+                self.assertIs(exc("msg", ratelimit=r).ratelimit, r)
+                with self.assertRaises(TypeError):
+                    exc()
+
     def test_key_length_limits(self):
-        _get_group_hash.cache_clear()
-        for ha in ["md5", "sha256", "sha512"]:
+        keys = set()
+        for ha in ["md5", "sha256", "sha512", "blake2b"]:
             with override_settings(RATELIMIT_GROUP_HASH=ha):
                 h = hashlib.new(ha)
                 k = _get_cache_key("foo" * 255, h, "rfl:")
                 self.assertLess(len(k), 256, "%s: %s" % (ha, len(k)))
-            _get_group_hash.cache_clear()
+                keys.add(k)
+        # the group hash cache is cleared on setting changes
+        self.assertEqual(len(keys), 4)
 
     def test_keyfunc_retrieval(self):
         self.assertIsInstance(_retrieve_key_func("ip"), types.FunctionType)
         _retrieve_key_func("ip")(
-            self.factory.get("/home"), "foo", ratelimit.Action.PEEK, None
+            copy.copy(self.home_request), "foo", ratelimit.Action.PEEK, None
         )
         with self.assertRaises(ValueError):
             _retrieve_key_func("_ip")
@@ -81,31 +121,40 @@ class ConstructionTests(TestCase):
         )
         self.assertEqual(
             _retrieve_key_func("tests.test_ratelimit.fake_key_function")(
-                self.factory.get("/home"), "foo", ratelimit.Action.PEEK, None
+                copy.copy(self.home_request), "foo", ratelimit.Action.PEEK, None
             ),
             "fake1",
         )
         self.assertEqual(
             _retrieve_key_func("tests.test_ratelimit.fake_key_function:fake2")(
-                self.factory.get("/home"), "foo", ratelimit.Action.PEEK, None
+                copy.copy(self.home_request), "foo", ratelimit.Action.PEEK, None
             ),
             "fake2",
         )
 
         self.assertEqual(
             _retrieve_key_func(("tests.test_ratelimit.fake_key_function", "fake", "2"))(
-                self.factory.get("/home"), "foo", ratelimit.Action.PEEK, None
+                copy.copy(self.home_request), "foo", ratelimit.Action.PEEK, None
             ),
             "fake2",
         )
 
         self.assertEqual(
             _retrieve_key_func((fake_key_function, "fake", "2"))(
-                self.factory.get("/home"), "foo", ratelimit.Action.PEEK, None
+                copy.copy(self.home_request), "foo", ratelimit.Action.PEEK, None
             ),
             "fake2",
         )
 
+    def test_resolve_key(self):
+        class KeyStr(str):
+            pass
+
+        for key in ["ip", KeyStr("ip"), ["ip"], ("ip",)]:
+            with self.subTest(key=key):
+                self.assertIs(_resolve_key(key), _retrieve_key_func("ip"))
+        self.assertIs(_resolve_key(fake_key_function), fake_key_function)
+
     def testparse_rate(self):
         for rate in [
             ("1/4", (1, 4)),
@@ -123,54 +172,60 @@ class ConstructionTests(TestCase):
             self.assertEqual(r, rate[1])
         with self.assertRaises(NotImplementedError):
             parse_rate(True)
-        with self.assertRaisesRegex(ValueError, "invalid rate format"):
-            parse_rate("1")
-        with self.assertRaisesRegex(AssertionError, "invalid rate detected"):
-            parse_rate("1/0s")
-        with self.assertRaisesRegex(AssertionError, "invalid rate detected"):
-            parse_rate([1, 0])
-        with self.assertRaisesRegex(AssertionError, "invalid rate detected"):
-            parse_rate([1, 1, 1])
+        for rate, exc, msg in [
+            ("1", ValueError, "invalid rate format"),
+            ("1/0s", AssertionError, "invalid rate detected"),
+            ([1, 0], AssertionError, "invalid rate detected"),
+            ([1, 1, 1], AssertionError, "invalid rate detected"),
+        ]:
+            with self.subTest(rate=rate):
+                with self.assertRaisesRegex(exc, msg):
+                    parse_rate(rate)
 
 
-class RatelimitTests(TestCase):
-    def setUp(self):
-        self.factory = RequestFactory()
+class RatelimitTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.factory = RequestFactory()
+        cls.home_request = cls.factory.get("/home")
 
     def test_basic(self):
-        r = None
-        for i in range(0, 4):
-            # just view, without retrieving
-            r = ratelimit.get_ratelimit(group="test_basic", rate="1/s", key=b"abc")
-            self.assertEqual(r.request_limit, 0)
-
-        for i in range(0, 2):
+        clock = VirtualClock()
+        with mock.patch("time.time", clock.time):
+            r = None
+            for i in range(0, 2):
+                # just view, without retrieving
+                r = ratelimit.get_ratelimit(group="test_basic", rate="1/s", key=b"abc")
+                self.assertEqual(r.request_limit, 0)
+
+            for i in range(0, 2):
+                r = ratelimit.get_ratelimit(
+                    group="test_basic",
+                    rate="1/s",
+                    key=b"abc2",
+                    action=ratelimit.Action.INCREASE,
+                )
+            self.assertEqual(r.request_limit, 1)
+            with self.assertRaises(ratelimit.RatelimitExceeded):
+                r.check(block=True)
+
+            self.assertEqual(r.count, 2)
             r = ratelimit.get_ratelimit(
                 group="test_basic",
                 rate="1/s",
                 key=b"abc2",
                 action=ratelimit.Action.INCREASE,
             )
-        self.assertEqual(r.request_limit, 1)
-        with self.assertRaises(ratelimit.RatelimitExceeded):
-            r.check(block=True)
-
-        self.assertEqual(r.count, 2)
-        r = ratelimit.get_ratelimit(
-            group="test_basic",
-            rate="1/s",
-            key=b"abc2",
-            action=ratelimit.Action.INCREASE,
-        )
-        self.assertEqual(r.request_limit, 1)
-        time.sleep(2)
-        r = ratelimit.get_ratelimit(
-            group="test_basic",
-            rate="1/s",
-            key=b"abc2",
-            action=ratelimit.Action.INCREASE,
-        )
-        self.assertEqual(r.request_limit, 0)
+            self.assertEqual(r.request_limit, 1)
+            clock.sleep(2)
+            r = ratelimit.get_ratelimit(
+                group="test_basic",
+                rate="1/s",
+                key=b"abc2",
+                action=ratelimit.Action.INCREASE,
+            )
+            self.assertEqual(r.request_limit, 0)
 
     def test_bad_rate_keyfn(self):
         def fn(request, group, action, rate):
@@ -200,11 +255,42 @@ class RatelimitTests(TestCase):
         ratelimit.get_ratelimit(group="test_no_rate_keyfn", key=fn3)
         ratelimit.get_ratelimit(group="test_no_rate_keyfn", key=1)
 
+    def test_shortcut_not_shared(self):
+        r1 = ratelimit.get_ratelimit(group="test_shortcut_not_shared", key=False)
+        r2 = ratelimit.get_ratelimit(group="test_shortcut_not_shared", key=False)
+        self.assertEqual(r1, r2)
+        self.assertIsNot(r1, r2)
+
     def test_fallbacks(self):
         r = ratelimit.get_ratelimit(group="test_fallbacks", rate="1/10s", key=b"abc")
         r.cache.set(f"{r.cache_key}_expire", int(time.time()) - 2)
         ratelimit.get_ratelimit(group="test_fallbacks", rate="1/10s", key=b"abc")
 
+    def test_fallbacks_vanished_counter(self):
+        r = ratelimit.get_ratelimit(
+            group="test_fallbacks_vanished_counter",
+            rate="1/10s",
+            key=b"abc",
+            action=ratelimit.Action.INCREASE,
+        )
+        self.assertEqual(r.count, 1)
+        r = ratelimit.get_ratelimit(
+            group="test_fallbacks_vanished_counter",
+            rate="1/10s",
+            key=b"abc",
+            action=ratelimit.Action.INCREASE,
+        )
+        self.assertEqual(r.count, 2)
+        # expire key is still there, the counter not
+        r.cache.delete(r.cache_key)
+        r = ratelimit.get_ratelimit(
+            group="test_fallbacks_vanished_counter",
+            rate="1/10s",
+            key=b"abc",
+            action=ratelimit.Action.INCREASE,
+        )
+        self.assertEqual(r.count, 1)
+
     def test_fallbacks_cache(self):
         cache = AlternatingAdd()
         r = ratelimit.get_ratelimit(
@@ -301,7 +387,7 @@ class RatelimitTests(TestCase):
             self.assertEqual(action, ratelimit.Action.INCREASE)
             return b"foo"
 
-        request = self.factory.get("/customer/details")
+        request = copy.copy(self.home_request)
         r = ratelimit.get_ratelimit(
             group=group_fn,
             rate=rate_fn,
@@ -323,6 +409,9 @@ class RatelimitTests(TestCase):
                 key=b"abc2",
                 action=ratelimit.Action.INCREASE,
             )
+            self.assertEqual(r.check(), i < 2)
+            # stays truthy, `if request.ratelimit:` tests for presence
+            self.assertTrue(r)
         self.assertEqual(r.request_limit, 1)
         obj = Foo()
         with self.assertRaises(ratelimit.RatelimitExceeded):
@@ -381,6 +470,10 @@ class RatelimitTests(TestCase):
         )
         self.assertEqual(r.request_limit, 0)
         self.assertEqual(r.count, 1)
+        self.assertTrue(r.can_reset)
+        r.cache_key = None
+        self.assertFalse(r.can_reset)
+        self.assertIsNone(r.reset())
 
     def test_reset_epoch(self):
         for i in range(0, 2):
@@ -480,8 +573,27 @@ class RatelimitTests(TestCase):
     def test_window(self):
         # window should start with first INCREASE and end after period
         # (fixed window counter algorithm)
-        r = None
-        for i in range(0, 2):
+        clock = VirtualClock()
+        with mock.patch("time.time", clock.time):
+            r = None
+            for i in range(0, 2):
+                r = ratelimit.get_ratelimit(
+                    group="test_window",
+                    rate="2/4s",
+                    key=b"abc",
+                    action=ratelimit.Action.INCREASE,
+                )
+                self.assertEqual(r.request_limit, 0)
+                clock.sleep(1)
+            r = ratelimit.get_ratelimit(
+                group="test_window",
+                rate="2/4s",
+                key=b"abc",
+                action=ratelimit.Action.INCREASE,
+            )
+            self.assertEqual(r.request_limit, 1)
+            # window times out
+            clock.sleep(3)
             r = ratelimit.get_ratelimit(
                 group="test_window",
                 rate="2/4s",
@@ -489,26 +601,9 @@ class RatelimitTests(TestCase):
                 action=ratelimit.Action.INCREASE,
             )
             self.assertEqual(r.request_limit, 0)
-            time.sleep(1)
-        r = ratelimit.get_ratelimit(
-            group="test_window",
-            rate="2/4s",
-            key=b"abc",
-            action=ratelimit.Action.INCREASE,
-        )
-        self.assertEqual(r.request_limit, 1)
-        # window times out
-        time.sleep(3)
-        r = ratelimit.get_ratelimit(
-            group="test_window",
-            rate="2/4s",
-            key=b"abc",
-            action=ratelimit.Action.INCREASE,
-        )
-        self.assertEqual(r.request_limit, 0)
 
     def test_block_empty(self):
-        request = self.factory.get("/customer/details")
+        request = copy.copy(self.home_request)
         request.user = AnonymousUser()
         r = ratelimit.get_ratelimit(
             group="test_block_empty",
@@ -521,9 +616,9 @@ class RatelimitTests(TestCase):
 
     def test_bypass_empty(self):
         r = None
-        request = self.factory.get("/customer/details")
+        request = copy.copy(self.home_request)
         request.user = AnonymousUser()
-        for i in range(0, 4):
+        for i in range(0, 2):
             r = ratelimit.get_ratelimit(
                 group="test_bypass_empty",
                 rate="1/s",
@@ -539,21 +634,21 @@ class RatelimitTests(TestCase):
                 group="test_disabled1",
                 rate="0/s",
                 key="ip",
-                request=self.factory.get("/home"),
+                request=copy.copy(self.home_request),
             )
         with self.assertRaises(ratelimit.Disabled):
             ratelimit.get_ratelimit(
                 group="test_disabled2",
                 rate=(0, 4),
                 key="ip",
-                request=self.factory.get("/home"),
+                request=copy.copy(self.home_request),
             )
 
     def test_request(self):
         r = None
-        request = self.factory.get("/customer/details")
-        for i in range(0, 4):
-            # peek 4 times
+        request = copy.copy(self.home_request)
+        for i in range(0, 2):
+            # peek twice, peeking must not count
             r = ratelimit.get_ratelimit(
                 group="test_request", rate="1/s", key="ip", request=request
             )
@@ -581,7 +676,7 @@ class RatelimitTests(TestCase):
 
     def test_request_reset_epoch(self):
         r = None
-        request = self.factory.get("/customer/details")
+        request = copy.copy(self.home_request)
         for i in range(0, 2):
             r = ratelimit.get_ratelimit(
                 group="test_request_reset_epoch",
@@ -590,7 +685,7 @@ class RatelimitTests(TestCase):
                 request=request,
                 action=ratelimit.Action.INCREASE,
             )
-        request = self.factory.get("/customer/details")
+        request = copy.copy(self.home_request)
         for i in range(0, 2):
             r = ratelimit.get_ratelimit(
                 group="test_request_reset_epoch",
@@ -601,7 +696,7 @@ class RatelimitTests(TestCase):
             )
         self.assertEqual(r.request_limit, 1)
         r.reset(request)
-        request = self.factory.get("/customer/details")
+        request = copy.copy(self.home_request)
         r = ratelimit.get_ratelimit(
             group="test_request_reset_epoch",
             rate="2/m",
@@ -614,7 +709,7 @@ class RatelimitTests(TestCase):
 
     def test_request_post_get_filter(self):
         r = None
-        request = self.factory.get("/customer/details")
+        request = copy.copy(self.home_request)
         for i in range(0, 4):
             r = ratelimit.get_ratelimit(
                 group="test_request_post_get_filter",
@@ -647,7 +742,7 @@ class RatelimitTests(TestCase):
         self.assertEqual(r.request_limit, 1)
 
     def test_inverted(self):
-        request = self.factory.get("/customer/details")
+        request = copy.copy(self.home_request)
         r = ratelimit.get_ratelimit(
             group="test_inverted",
             rate="1/s",
@@ -658,55 +753,67 @@ class RatelimitTests(TestCase):
         )
         self.assertEqual(r.count, 0)
 
+
+class BackendTests(TestCase):
+    # the db cache needs database access
     def test_backends_impicit(self):
-        for ha in ["md5", "sha256", "sha512"]:
+        for ha in ["md5", "sha256", "sha512", "blake2b"]:
             for cache in ["default", "db"]:
                 with override_settings(
                     RATELIMIT_DEFAULT_CACHE=cache,
                     RATELIMIT_GROUP_HASH=ha,
                     RATELIMIT_KEY_HASH=ha,
                 ):
-                    r = None
-                    for i in range(0, 4):
-                        r = ratelimit.get_ratelimit(
-                            group="test_backends_implicit",
-                            rate="1/30s",
-                            key=b"implicittest",
-                        )
-                        self.assertEqual(r.request_limit, 0)
+                    with self.subTest(ha=ha, cache=cache):
+                        r = None
+                        for i in range(0, 2):
+                            r = ratelimit.get_ratelimit(
+                                group="test_backends_implicit",
+                                rate="1/30s",
+                                key=b"implicittest",
+                            )
+                            self.assertEqual(r.request_limit, 0)
 
-                    for i in range(0, 2):
+                        for i in range(0, 2):
+                            r = ratelimit.get_ratelimit(
+                                group="test_backends_implicit",
+                                rate="1/30s",
+                                key=b"implicittest",
+                                action=ratelimit.Action.INCREASE,
+                            )
+                        self.assertEqual(r.request_limit, 1)
                         r = ratelimit.get_ratelimit(
                             group="test_backends_implicit",
                             rate="1/30s",
                             key=b"implicittest",
                             action=ratelimit.Action.INCREASE,
                         )
-                    self.assertEqual(r.request_limit, 1)
-                    r = ratelimit.get_ratelimit(
-                        group="test_backends_implicit",
-                        rate="1/30s",
-                        key=b"implicittest",
-                        action=ratelimit.Action.INCREASE,
-                    )
-                    self.assertEqual(r.request_limit, 1)
-            _get_group_hash.cache_clear()
+                        self.assertEqual(r.request_limit, 1)
 
     def test_backends_explicit(self):
-        for ha in ["md5", "sha256", "sha512"]:
+        for ha in ["md5", "sha256", "sha512", "blake2b"]:
             for cache in ["default", "db"]:
                 with override_settings(RATELIMIT_GROUP_HASH=ha, RATELIMIT_KEY_HASH=ha):
-                    r = None
-                    for i in range(0, 4):
-                        r = ratelimit.get_ratelimit(
-                            group="test_backends_explicit",
-                            rate="1/30s",
-                            key=b"explicittest",
-                            cache=cache,
-                        )
-                        self.assertEqual(r.request_limit, 0)
+                    with self.subTest(ha=ha, cache=cache):
+                        r = None
+                        for i in range(0, 2):
+                            r = ratelimit.get_ratelimit(
+                                group="test_backends_explicit",
+                                rate="1/30s",
+                                key=b"explicittest",
+                                cache=cache,
+                            )
+                            self.assertEqual(r.request_limit, 0)
 
-                    for i in range(0, 2):
+                        for i in range(0, 2):
+                            r = ratelimit.get_ratelimit(
+                                group="test_backends_explicit",
+                                rate="1/30s",
+                                key=b"explicittest",
+                                action=ratelimit.Action.INCREASE,
+                                cache=cache,
+                            )
+                        self.assertEqual(r.request_limit, 1)
                         r = ratelimit.get_ratelimit(
                             group="test_backends_explicit",
                             rate="1/30s",
@@ -714,22 +821,15 @@ class RatelimitTests(TestCase):
                             action=ratelimit.Action.INCREASE,
                             cache=cache,
                         )
-                    self.assertEqual(r.request_limit, 1)
-                    r = ratelimit.get_ratelimit(
-                        group="test_backends_explicit",
-                        rate="1/30s",
-                        key=b"explicittest",
-                        action=ratelimit.Action.INCREASE,
-                        cache=cache,
-                    )
-                    self.assertEqual(r.request_limit, 1)
-            _get_group_hash.cache_clear()
+                        self.assertEqual(r.request_limit, 1)
 
 
 @unittest.skipIf(VERSION[:2] < (4, 0), "unsuported")
-class AsyncTests(TestCase):
-    def setUp(self):
-        self.factory = RequestFactory()
+class AsyncTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.factory = RequestFactory()
 
     async def test_sync_in_async(self):
         from django.utils.asyncio import async_unsafe
@@ -830,3 +930,71 @@ class AsyncTests(TestCase):
         )
         self.assertEqual(r.request_limit, 0)
         self.assertEqual(r.count, 2)
+
+    @override_settings(RATELIMIT_CACHE_THREADSAFE=True)
+    async def test_reset_threadsafe_cache(self):
+        class Foo:
+            pass
+
+        epoch = Foo()
+        for i in range(0, 3):
+            r = await ratelimit.aget_ratelimit(
+                group="atest_reset_threadsafe_cache",
+                rate="2/m",
+                key=b"abc2",
+                action=ratelimit.Action.INCREASE,
+                epoch=epoch,
+            )
+        self.assertEqual(r.request_limit, 1)
+        self.assertEqual(await r.areset(epoch), 0)
+        r = await ratelimit.aget_ratelimit(
+            group="atest_reset_threadsafe_cache",
+            rate="2/m",
+            key=b"abc2",
+            action=ratelimit.Action.INCREASE,
+        )
+        self.assertEqual(r.count, 1)
+        self.assertEqual(await r.areset(), 1)
+
+    async def test_acheck_wait_shared(self):
+        import asyncio
+
+        from django_fast_ratelimit.misc import _end_waiters
+
+        loop = asyncio.get_running_loop()
+        end = int(time.time()) + 10
+        key = (loop, "atest_acheck_wait", end)
+        r1 = ratelimit.Ratelimit(group="atest_acheck_wait", request_limit=1, end=end)
+        r2 = ratelimit.Ratelimit(group="atest_acheck_wait", request_limit=1, end=end)
+        with mock.patch.object(loop, "call_later") as call_later:
+            task1 = asyncio.ensure_future(r1.acheck(wait=True))
+            task2 = asyncio.ensure_future(r2.acheck(wait=True))
+            await asyncio.sleep(0)
+        # one timer for both waiters
+        call_later.assert_called_once()
+        self.assertEqual(_end_waiters[key][2], 2)
+        # fire the timer instead of waiting for it
+        callback, *args = call_later.call_args.args[1:]
+        callback(*args)
+        self.assertEqual(await asyncio.gather(task1, task2), [False, False])
+        self.assertNotIn(key, _end_waiters)
+
+    async def test_acheck_wait_cancelled(self):
+        import asyncio
+
+        from django_fast_ratelimit.misc import _end_waiters
+
+        loop = asyncio.get_running_loop()
+        end = int(time.time()) + 10
+        key = (loop, "atest_acheck_wait_cancelled", end)
+        r = ratelimit.Ratelimit(
+            group="atest_acheck_wait_cancelled", request_limit=1, end=end
+        )
+        task = asyncio.ensure_future(r.acheck(wait=True))
+        await asyncio.sleep(0)
+        timer = _end_waiters[key][1]
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertNotIn(key, _end_waiters)
+        self.assertTrue(timer.cancelled())